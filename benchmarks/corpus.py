@@ -0,0 +1,134 @@
+'''
+Synthetic HaX corpus for benchmarks, written for code/article.json.
+The same seed and size always give the same document.
+
+    python benchmarks/corpus.py [--seed 1] [--size 1.0] [-o corpus.hax]
+
+A document is a sequence of blocks, chosen at random:
+    text: paragraphs with long runs of text and inline elements
+    nesting: deeply nested divs
+    attributes: tags with many attributes, in hax and in xml modus
+    parent: lists, definition lists and tables (alternating-child rules of "parent")
+    skip: large script and style blocks
+    entities: large code blocks with <, > and &
+'''
+
+import argparse, random, sys
+
+WORDS = ('hax', 'markup', 'element', 'attribute', 'parser', 'node', 'text', 'lorem', 'ipsum',
+         'dolor', 'sit', 'amet', 'the', 'a', 'of', 'and', 'to', 'in', 'is', 'with', 'for')
+
+def words(rnd, n):
+    
+    return ' '.join(rnd.choice(WORDS) for i in range(n))
+
+def text(rnd):
+    '''paragraphs with long text runs and some inline elements'''
+    
+    out = []
+    for p in range(rnd.randint(1, 4)):
+        run = [words(rnd, rnd.randint(40, 200))]
+        for k in range(rnd.randint(0, 6)):
+            run.append(rnd.choice(['<S %s>', '<em %s>', '<a,HAX %s>', '<Q %s>', '\\< %s \\>']) % words(rnd, rnd.randint(1, 5)))
+            run.append(words(rnd, rnd.randint(5, 60)))
+        out.append('< %s>\n' % ' '.join(run))
+    return ''.join(out)
+
+def nesting(rnd):
+    '''divs nested deeply, with text at every level'''
+    
+    depth = rnd.randint(10, 60)
+    out = []
+    for d in range(depth):
+        out.append('<div.level%d %s ' % (d, words(rnd, rnd.randint(1, 8))))
+    out.append(words(rnd, 10))
+    out.append('>' * depth)
+    out.append('\n')
+    return ''.join(out)
+
+def attributes(rnd):
+    '''tags with many attributes: hax shortcuts, short names and xml modus (starts with '<<')'''
+    
+    out = []
+    for k in range(rnd.randint(2, 8)):
+        classes = ''.join('.c%d' % rnd.randint(0, 99) for i in range(rnd.randint(1, 6)))
+        out.append('<p%s#id%d@T="%s"@AL="%s"@AR="note"|dc:subject %s>\n' % (classes, rnd.randint(0, 10**6), words(rnd, 3), words(rnd, 2), words(rnd, 12)))
+        atts = ' '.join('data-%s%d="%s"' % (rnd.choice(WORDS), i, words(rnd, 2)) for i in range(rnd.randint(3, 12)))
+        out.append('<<p class="x y" title="%s" %s>%s</p>\n' % (words(rnd, 4), atts, words(rnd, 20)))
+        out.append('<<button,button;"myFunction()" %s>\n' % words(rnd, 2)) # '<<': back to hax modus
+    return ''.join(out)
+
+def parent(rnd):
+    '''children without element name: li, dt/dd, td and p by the parent rules'''
+    
+    out = []
+    kind = rnd.choice(['ul', 'ol', 'dl', 'table', 'figure'])
+    if kind in ['ul', 'ol']:
+        out.append('<%s\n' % kind)
+        for i in range(rnd.randint(3, 30)):
+            out.append('< %s>\n' % words(rnd, rnd.randint(2, 15)))
+        out.append('>\n')
+    elif kind == 'dl':
+        out.append('<dl\n')
+        for i in range(rnd.randint(2, 20)):
+            out.append('< %s>\n< %s>\n' % (words(rnd, 2), words(rnd, rnd.randint(5, 30))))
+        out.append('>\n')
+    elif kind == 'table':
+        out.append('<table\n< %s>\n' % words(rnd, 4))
+        for r in range(rnd.randint(2, 20)):
+            out.append('<tr %s>\n' % ''.join('< %s>' % words(rnd, 2) for c in range(rnd.randint(2, 8))))
+        out.append('>\n')
+    else:
+        out.append('<F\n<pre <CH\n%s<//>\n< %s>\n>\n' % ('\tx < y && y > z;\n' * rnd.randint(2, 10), words(rnd, 4)))
+    return ''.join(out)
+
+def skip(rnd):
+    '''script or style block, not parsed'''
+    
+    if rnd.random() < 0.5:
+        lines = ['function f%d(a, b) { if (a < b && b > 0) { return "<p>" + a; } }\n' % i for i in range(rnd.randint(20, 400))]
+        return '<script\n%s<//\n' % ''.join(lines)
+    lines = ['.c%d > p { color: #%06x; }\n' % (i, rnd.randint(0, 0xffffff)) for i in range(rnd.randint(20, 400))]
+    return '<style\n%s<//\n' % ''.join(lines)
+
+def entities(rnd):
+    '''code block: <, > and & become entities'''
+    
+    lines = ['if (a < b && c > d) { x = "<%s>"; }\n' % rnd.choice(WORDS) for i in range(rnd.randint(20, 400))]
+    return '<pre <CH\n%s<//>\n' % ''.join(lines)
+
+BLOCKS = [(text, 30), (nesting, 10), (attributes, 15), (parent, 25), (skip, 10), (entities, 10)]
+
+def generate(seed=1, size=1.0):
+    '''HaX document of about size MB (characters), made from seed'''
+    
+    rnd = random.Random(seed)
+    kinds = [b for b, weight in BLOCKS for i in range(weight)]
+    out = ['<h1|dc:title Benchmark corpus %d>\n<p|dc:language en>\n' % seed]
+    n = 0
+    limit = int(size * 1e6)
+    while n < limit:
+        block = rnd.choice(kinds)(rnd)
+        out.append(block)
+        n += len(block)
+    out.append('<!-- end of corpus -->\n')
+    return ''.join(out)
+
+def main():
+    
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--size', type=float, default=1.0, help='size in MB (default 1.0)')
+    ap.add_argument('-o', '--output', help='file (default: stdout)')
+    args = ap.parse_args()
+    
+    doc = generate(args.seed, args.size)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(doc)
+    else:
+        sys.stdout.write(doc)
+
+if __name__ == '__main__':
+    
+    main()
@@ -0,0 +1,64 @@
+'''
+Edit latency of hax.Session on a synthetic corpus (see corpus.py): the time from an edit
+to the changed range of the output, for edits at random offsets.
+
+    python benchmarks/edits.py [--seed 1] [--size 2.0] [--edits 500] [--wrap]
+
+--wrap puts the whole corpus in one element, so that no block starts at top level.
+Every edit types one character, or deletes it again when the character makes an error.
+'''
+
+import argparse, os, random, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+import hax
+from corpus import generate
+
+def main():
+    
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('-c', '--code', default=os.path.join(os.path.dirname(HERE), 'code', 'article.json'))
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--size', type=float, default=2.0, help='size of corpus in MB (default 2.0)')
+    ap.add_argument('--edits', type=int, default=500, help='number of edits (default 500)')
+    ap.add_argument('--wrap', help='corpus inside one element', action='store_true')
+    args = ap.parse_args()
+    
+    converter = hax.Converter(args.code, wrap=False)
+    source = generate(args.seed, args.size)
+    if args.wrap:
+        source = '<div\n%s>\n' % source
+    
+    start = time.perf_counter()
+    converter.convert(source)
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    session = converter.session(source)
+    opened = time.perf_counter() - start
+    
+    rnd = random.Random(args.seed)
+    size = len(source)
+    times = []
+    errors = 0
+    for e in range(args.edits):
+        offset = rnd.randrange(size)
+        start = time.perf_counter()
+        try:
+            session.edit(offset, 0, 'a')
+            size += 1
+        except hax.HaxError:
+            errors += 1
+            session.edit(offset, 1, '')
+        times.append(time.perf_counter() - start)
+    times.sort()
+    
+    print('corpus: seed %d, %d characters, %d blocks' % (args.seed, len(source), len(session.blocks)))
+    print('full convert %.1f ms, session %.1f ms' % (full * 1000, opened * 1000))
+    print('edit: median %.3f ms, p90 %.3f ms, p99 %.3f ms, max %.3f ms (%d edits, %d with errors)' % (
+          times[len(times) // 2] * 1000, times[len(times) * 9 // 10] * 1000, times[len(times) * 99 // 100] * 1000, times[-1] * 1000, len(times), errors))
+
+if __name__ == '__main__':
+    
+    main()
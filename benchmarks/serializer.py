@@ -0,0 +1,76 @@
+'''
+Serializer benchmark: time per node of Haxparser.createXML() and of wrapping the
+body in html5 head and foot, for documents of growing size.
+With a linear serializer the time per node stays (about) constant.
+
+    python benchmarks/serializer.py [-c code/article.json] [--max 320000]
+'''
+
+import argparse, io, os, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+import hax
+
+BLOCK = '''<h2.red@T="Section" A section>
+<p.red@T="Hello World Popup" Paragraph with link: <a,HAX HaX @ NotSue> and <S strong words>.>
+<ul
+< item one>
+< item two with <a,"https://example.org" a link>>
+>
+<dl
+< term>
+< definition>
+>
+<!-- a comment -->
+<pre <CH
+    "parent": {"ul": "li"}
+<//>
+'''
+
+def parser(source, code):
+    '''Haxparser with parsed nodes of source'''
+    
+    with tempfile.NamedTemporaryFile('w', suffix='.hax', delete=False) as f:
+        f.write(source)
+    config = {'haxfile': f.name, 'output': None, 'format': 'html', 'code': code, 'nocomment': False,
+              'verbose': False, 'void': False, 'wait': True}
+    try:
+        return hax.Haxparser(config)
+    finally:
+        os.remove(f.name)
+
+def best(f, repeat=3):
+    
+    t = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        f()
+        t.append(time.perf_counter() - start)
+    return min(t)
+
+def main():
+    
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('-c', '--code', default=os.path.join(os.path.dirname(HERE), 'code', 'article.json'))
+    ap.add_argument('--max', type=int, default=320000, help='maximum number of nodes')
+    args = ap.parse_args()
+    
+    P = parser(BLOCK, args.code)
+    per_block = len(P.nodes)
+    print('%10s %12s %14s %14s' % ('nodes', 'createXML s', 'us/node', 'wrap us/node'))
+    blocks = max(1, 10000 // per_block)
+    first = None
+    while blocks * per_block <= args.max:
+        P = parser(BLOCK * blocks, args.code)
+        n = len(P.nodes)
+        t = best(P.createXML)
+        w = best(lambda: hax.writeDocument(io.StringIO().write, P.xml, 'html', P.metadata))
+        if first == None:
+            first = t / n
+        print('%10d %12.4f %14.3f %14.4f   (x%.2f)' % (n, t, t / n * 1e6, w / n * 1e6, t / n / first))
+        blocks *= 2
+
+if __name__ == '__main__':
+    
+    main()
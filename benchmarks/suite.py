@@ -0,0 +1,173 @@
+'''
+Benchmark suite: times the stages of hax on a synthetic corpus (see corpus.py) and
+reports them as MB/s (of HaX source) and nodes/s.
+
+    python benchmarks/suite.py [--seed 1] [--size 2.0] [--repeat 5] [--json results.json]
+                               [--compare previous.json] [--threshold 0.10]
+
+stages:
+    parse: Haxparser.parse(), source to nodes (metadata is collected on the way), every run
+           with an empty TagCache: repeated tags of the corpus are translated once
+    parse-warm: the same, with the TagCache of the previous run: all tags from the cache
+    xmlx2node: Haxparser.xmlx2node() for all tags of the corpus, with an empty TagCache
+    xmlx2node-warm: the same, with the TagCache of the previous run
+    createXML: Haxparser.createXML(), nodes to xml
+    tree: hax.tree(), nodes to an xml.etree.ElementTree element
+    metadata: Metadata.feed() for all nodes
+    encode: Converter.encode(), the xml of the corpus back to HaX
+    check: Haxparser with a haxfile in check mode: read and parse, nothing is kept or written
+           (empty TagCache)
+    end-to-end: Haxparser with a haxfile: read, parse, serialize and write html
+
+With --json the results are saved; with --compare the results are compared with saved
+results of an earlier run. A stage that is more than threshold slower is reported as a
+regression, and the exit status is 1.
+'''
+
+import argparse, json, os, platform, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+import hax
+from corpus import generate
+
+STAGES = ['parse', 'parse-warm', 'xmlx2node', 'xmlx2node-warm', 'createXML', 'tree', 'metadata', 'encode', 'check', 'end-to-end']
+
+def best(f, repeat=3, setup=None):
+    '''shortest time of repeat runs of f(); setup() runs before every run, not timed'''
+    
+    t = []
+    for r in range(repeat):
+        if setup != None:
+            setup()
+        start = time.perf_counter()
+        f()
+        t.append(time.perf_counter() - start)
+    return min(t)
+
+def parser(source, code):
+    '''Haxparser without haxfile, ready to parse source'''
+    
+    P = hax.Haxparser({'format': 'html', 'nocomment': False, 'void': False, 'wait': False, 'verbose': False}, code=code)
+    P.source = source
+    return P
+
+def tags(P):
+    '''arguments of all xmlx2node() calls while P parses'''
+    
+    calls = []
+    xmlx2node = P.xmlx2node
+    def record(*args):
+        calls.append(args)
+        return xmlx2node(*args)
+    P.xmlx2node = record
+    try:
+        P.parse()
+    finally:
+        del P.xmlx2node
+    return calls
+
+def run(source, codepath, repeat):
+    '''({stage: (seconds, count)}, stats of the TagCache); count: number of nodes (or tags) of the stage'''
+    
+    code = hax.HaxCode.load(codepath)
+    stages = {}
+    
+    cold = code.tags.tags.clear # an empty TagCache: every tag is translated once
+    P = parser(source, code)
+    stages['parse'] = best(P.parse, repeat, cold)
+    stages['parse-warm'] = best(P.parse, repeat)
+    nodes = len(P.nodes)
+    stages['createXML'] = best(P.createXML, repeat)
+    stages['tree'] = best(lambda: hax.tree(P.nodes), repeat)
+    
+    def metadata():
+        feed = hax.Metadata().feed
+        for N in P.nodes:
+            feed(N)
+    stages['metadata'] = best(metadata, repeat)
+    
+    P.createXML()
+    xml = P.xml
+    converter = hax.Converter(code)
+    stages['encode'] = best(lambda: converter.encode(xml), repeat)
+    
+    calls = tags(parser(source, code))
+    def xmlx2node():
+        f = P.xmlx2node
+        for args in calls:
+            f(*args)
+    stages['xmlx2node'] = best(xmlx2node, repeat, cold)
+    stages['xmlx2node-warm'] = best(xmlx2node, repeat)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        haxfile = os.path.join(tmp, 'corpus.hax')
+        with open(haxfile, 'w', encoding='utf-8') as f:
+            f.write(source)
+        config = {'haxfile': haxfile, 'output': os.path.join(tmp, 'corpus.html'), 'format': 'html', 'code': codepath,
+                  'nocomment': False, 'verbose': False, 'void': False, 'wait': False}
+        stages['end-to-end'] = best(lambda: hax.Haxparser(dict(config)), repeat)
+        stages['check'] = best(lambda: hax.Haxparser(dict(config, check=True), code=code), repeat, cold)
+    
+    counts = {'xmlx2node': len(calls), 'xmlx2node-warm': len(calls)}
+    return {s: (stages[s], counts.get(s, nodes)) for s in STAGES}, code.tags.stats()
+
+def report(results, previous=None, threshold=0.10):
+    '''prints results; returns the stages that are slower than in previous by more than threshold'''
+    
+    regressions = []
+    print('%-14s %10s %10s %14s' % ('stage', 'seconds', 'MB/s', 'nodes/s') + ('  %10s' % 'vs previous' if previous else ''))
+    for stage, r in results['stages'].items():
+        line = '%-14s %10.4f %10.2f %14.0f' % (stage, r['seconds'], r['MB/s'], r['nodes/s'])
+        if previous and stage in previous['stages']:
+            ratio = r['MB/s'] / previous['stages'][stage]['MB/s']
+            line += '  %10s' % ('x%.2f' % ratio)
+            if ratio < 1 - threshold:
+                line += '  REGRESSION'
+                regressions.append(stage)
+        print(line)
+    return regressions
+
+def main():
+    
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('-c', '--code', default=os.path.join(os.path.dirname(HERE), 'code', 'article.json'))
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--size', type=float, default=2.0, help='size of corpus in MB (default 2.0)')
+    ap.add_argument('--repeat', type=int, default=5, help='best of repeat runs (default 5)')
+    ap.add_argument('--json', help='save results in this file')
+    ap.add_argument('--compare', help='results (json) of an earlier run')
+    ap.add_argument('--threshold', type=float, default=0.10, help='slowdown reported as regression (default 0.10)')
+    args = ap.parse_args()
+    
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if (previous['seed'], previous['size']) != (args.seed, args.size):
+            print('warning: %s has seed %s and size %s' % (args.compare, previous['seed'], previous['size']), file=sys.stderr)
+    
+    source = generate(args.seed, args.size)
+    size = len(source.encode('utf-8'))
+    results = {'seed': args.seed, 'size': args.size, 'bytes': size, 'repeat': args.repeat,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'stages': {}}
+    stages, results['tag cache'] = run(source, args.code, args.repeat)
+    for stage, (t, count) in stages.items():
+        results['stages'][stage] = {'seconds': t, 'count': count, 'MB/s': size / t / 1e6, 'nodes/s': count / t}
+    results['nodes'] = results['stages']['parse']['count']
+    
+    print('corpus: seed %d, %d bytes, %d nodes' % (args.seed, size, results['nodes']))
+    print('tag cache: %(entries)d of %(size)d entries, %(hits)d hits, %(misses)d misses (%(rate).1f%%), %(clears)d clears' % dict(results['tag cache'], rate=results['tag cache']['rate'] * 100))
+    regressions = report(results, previous, args.threshold)
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    
+    main()
@@ -1,46 +1,488 @@
-import argparse, os, sys, json, copy
+import argparse, os, sys, json, copy, re, shutil, tempfile, hashlib, hmac, pickle, glob, io, time, contextlib, codecs
+import concurrent.futures, html, html.parser, asyncio, collections, mimetypes, urllib.parse, gzip, bisect, threading
+from xml.etree import ElementTree
 
 
 __VERSION__ = '0.1'
 __DATE__ = '2024-06-20'
 
+# scanners: next significant character per state of Haxparser.parse()
+TEXT_SCAN = re.compile(r'[\\<>]')
+HAX_TAG_SCAN = re.compile(r'[<>\'" \t\n]|/>')
+QUOTED_TAG_SCAN = re.compile(r'[<>\'"]|/>')
+XML_TAG_SCAN = re.compile(r'[<>]|/>')
+HAX_NAME_SCAN = re.compile(r'[\'" \t\n@]')
+CLOSERS = {'comment': '-->', 'cdata': ']]>', 'pi': '?>', 'declaration': '>'}
+ENTITIES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+LOOKAHEAD = 9 # longest look ahead of Haxparser.iterparse(): '<![CDATA['
+CHUNKSIZE = 1 << 16 # characters read at once in streaming mode
+TAGCACHE = 4096 # translated tags kept per HaxCode (see TagCache)
+BLOCKSIZE = 1 << 20 # minimum characters per block of a parallel parse (see Haxparser.parseParallel)
+VOID = ['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'] # void elements of html5
+COMPRESSORS = ['gz', 'bz2', 'xz'] # compressed variants of outputs (see Output)
+INCLUDE = re.compile(r'<\?hax\s+include\s*=\s*(?:"([^"]*)"|\'([^\']*)\')\s*\?>\Z') # <?hax include="file.hax"?>
+FRAGMENTNODES = 1 << 18 # nodes of included fragments kept per process (see FragmentCache)
+
+
+class HaxCode():
+    '''
+    HaXcode (JSON) compiled into lookup tables for Haxparser:
+    frozensets for skip and entities, the marker characters of hax-tags, a character class
+    of the characters that split an xmlx-tag, the parent/child rotation tables and
+    the element, attribute and value lookups; and the same lookups inverted, for Encoder.
+    
+    HaxCode.load() keeps the compiled tables in a __haxcache__ directory next to the JSON-file,
+    keyed by the content hash: next runs skip both JSON parsing and compiling. A cached file is
+    a pickle signed with a key of the user (see cacheKey): it is only unpickled when the
+    signature is right, so a file that others put in __haxcache__ can not run code.
+    A HaXcode with the wrong structure raises HaxError.
+    self.tags: the tags translated with this HaXcode (see TagCache), not pickled
+    '''
+    
+    VERSION = 3 # of the compiled tables: cached tables of other versions are ignored
+    CACHE = '__haxcache__'
+    KEY = False # of cacheKey(), read once per process
+    
+    def __init__(self, code, hash=None):
+        
+        try:
+            self.compile(code, hash)
+        except (AttributeError, KeyError, IndexError, TypeError, ValueError, re.error) as e:
+            error('Invalid HaXcode (%s: %s)' % (type(e).__name__, e), fatal=True)
+            
+    def compile(self, code, hash):
+        
+        if not isinstance(code, dict):
+            raise TypeError('not an object')
+        self.json = code
+        self.hash = hash # sha1 of the JSON-file
+        self.hax = dict(code.get('hax', {}))
+        self.comma = code.get('comma')
+        self.semicolon = code.get('semicolon')
+        self.value = dict(code.get('value', {}))
+        self.attributeName = dict(code.get('attributeName', {}))
+        self.elementName = {} # short name: (name, attributes or None)
+        for short, EL in code.get('elementName', {}).items():
+            if isinstance(EL, list) and isinstance(EL[0], str):
+                self.elementName[short] = (EL[0], dict(EL[1]) if len(EL) > 1 else None)
+            elif isinstance(EL, str):
+                self.elementName[short] = (EL, None)
+            else:
+                raise TypeError('elementName %s is not a name or [name, attributes]' % short)
+        self.parent = {} # parent: name of child, or tuple of alternating children
+        for parent, child in code.get('parent', {}).items():
+            if isinstance(child, str):
+                self.parent[parent] = child
+            else:
+                self.parent[parent] = tuple(child)
+        self.skip = frozenset(code.get('skip', []))
+        self.entities = frozenset(code.get('entities', []))
+        self.markers = frozenset([',', ';', '@'] + list(self.hax))
+        split = set(self.hax) | set(['"', "'", '=', ' ', '\t', '\n'])
+        if self.comma != None:
+            split.add(',')
+        if self.semicolon != None:
+            split.add(';')
+        self.tagscan = re.compile('[%s]' % re.escape(''.join(sorted(split))))
+        self.special = re.compile('[%s]' % re.escape(''.join(sorted(split | set(['@', '<', '>'])))))
+        
+        # inverted tables (see Encoder): shortest short name of a name, marker of an attribute
+        self.shortElement = {} # name: list of (short name, attributes or None)
+        for short, EL in sorted(self.elementName.items(), key=lambda S: len(S[0])):
+            if self.short(short):
+                self.shortElement.setdefault(EL[0], []).append((short, EL[1]))
+        self.shortAttribute = {}
+        for short, att in sorted(self.attributeName.items(), key=lambda S: len(S[0])):
+            if self.short(short):
+                self.shortAttribute.setdefault(att, short)
+        self.shortValue = {}
+        for short, val in sorted(self.value.items(), key=lambda S: len(S[0])):
+            if self.short(short) and short[0] not in '0123456789':
+                self.shortValue.setdefault(val, short)
+        self.marker = {} # attribute: character of hax
+        for char, att in self.hax.items():
+            self.marker.setdefault(att, char)
+        self.tags = TagCache()
+        
+    def __getstate__(self):
+        
+        state = dict(self.__dict__)
+        del state['tags']
+        return state
+        
+    def __setstate__(self, state):
+        
+        self.__dict__.update(state)
+        self.tags = TagCache()
+            
+    def short(self, name):
+        '''True if name is read as a short name in a tag'''
+        
+        return name != '' and name == name.upper() and not name.startswith('\\') and self.special.search(name) == None
+        
+    @classmethod
+    def cacheKey(cls):
+        '''secret of the user that signs cached tables: made once, readable by the user only; None if not possible'''
+        
+        if cls.KEY == False:
+            cls.KEY = cls.readKey()
+        return cls.KEY
+        
+    @staticmethod
+    def readKey():
+        
+        path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'hax', 'key')
+        try:
+            with open(path, 'rb') as f:
+                key = f.read()
+            if len(key) == 32:
+                return key
+        except OSError:
+            pass
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(32))
+            with open(path, 'rb') as f: # of another process, if it was first
+                key = f.read()
+            return key if len(key) == 32 else None
+        except OSError:
+            return None
+            
+    @classmethod
+    def load(cls, path, cache=True):
+        '''compiled tables of JSON-file path, from cache if up to date'''
+        
+        if not os.path.exists(path):
+            error("Code file '%s' does not exist" % path, fatal=True)
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        directory = os.path.join(os.path.dirname(path), cls.CACHE)
+        name = os.path.basename(path)
+        cached = os.path.join(directory, '%s.%s.v%d.pickle' % (name, digest[:16], cls.VERSION))
+        key = cls.cacheKey() if cache else None
+        
+        if key != None and os.path.exists(cached):
+            try:
+                with open(cached, 'rb') as f:
+                    signature, tables = f.read(32), f.read()
+                if hmac.compare_digest(signature, hmac.new(key, tables, 'sha256').digest()):
+                    code = pickle.loads(tables)
+                    if isinstance(code, cls) and code.hash == digest:
+                        return code
+            except Exception: # damaged or from other version of hax.py: compile again
+                pass
+            
+        try:
+            code = cls(json.loads(data), digest)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            error("Invalid JSON-file (syntax error)",filepath=path, fatal=True)
+        except HaxError as e:
+            e.filepath = path
+            raise
+            
+        if key != None:
+            part = '%s.%d.part' % (cached, os.getpid())
+            try:
+                os.makedirs(directory, exist_ok=True)
+                stale = re.compile(re.escape(name) + r'\.[0-9a-f]{16}\.v\d+\.pickle(?:\.\d+\.part)?$')
+                for old in os.listdir(directory): # tables of previous versions of the JSON-file, and left parts
+                    if stale.match(old) and old != os.path.basename(part):
+                        os.remove(os.path.join(directory, old))
+                tables = pickle.dumps(code, pickle.HIGHEST_PROTOCOL)
+                with open(part, 'wb') as f:
+                    f.write(hmac.new(key, tables, 'sha256').digest())
+                    f.write(tables)
+                os.replace(part, cached)
+            except Exception: # read-only directory, or tables that do not pickle: no cache
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+        return code
+        
+class TagCache():
+    '''
+    translated tags of one HaxCode, shared by all its parsers: real documents repeat a few tags
+    thousands of times, and a repeated tag is one dict lookup instead of a scan.
+        haxtag (string): the xmlx of hax2xmlx() in Haxparser.iterparse, without the implied name.
+          The name a nameless tag gets from its parent (and the alternating counter) is not
+          cached: it is given on every tag, so the counters of parent rules advance as before.
+        (type, xmlx, void): (type, ns, name, attributes) of Haxparser.xmlx2node()
+    A tag with errors is not cached: check mode reports it every time.
+    At size entries the cache is cleared (clears counts how often).
+    hits and misses count the lookups of xmlx2node (see rate()); under threads they are approximate.
+    '''
+    
+    def __init__(self, size=TAGCACHE):
+        
+        self.size = size
+        self.tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.clears = 0
+        
+    def put(self, key, value):
+        
+        if len(self.tags) >= self.size:
+            self.tags.clear()
+            self.clears += 1
+        self.tags[key] = value
+        
+    def rate(self):
+        '''hits / lookups of xmlx2node'''
+        
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+        
+    def stats(self):
+        
+        return {'size': self.size, 'entries': len(self.tags), 'hits': self.hits, 'misses': self.misses, 'clears': self.clears, 'rate': self.rate()}
+        
+class Dialects():
+    '''
+    registry of compiled HaXcodes (dialects), for programs that convert documents of several
+    dialects, like one Converter for article, slides and data-xml:
+    
+        dialects = Dialects({'article': 'code/article.json', 'slides': 'code/slides.json'})
+        converter = Converter(dialects)
+        page = converter.convert(text, dialect='slides')
+        
+    A dialect is found by its name or by the content hash of its HaXcode (HaxCode.hash).
+    Compiled dialects are kept in LRU order, bounded by size (bytes, estimated from the entries
+    of their tables and of their TagCache, see estimate()): the least recently used is evicted
+    when room is needed, its TagCache is cleared. A name keeps the path of a JSON-file, and the
+    dialect is compiled again (from the __haxcache__ of the file, see HaxCode.load) when it is
+    used again, also when it is asked for by its hash; a dialect given as dict or HaxCode has
+    to be added again.
+    
+    sources: {name: source} or a list of paths (name: file name without .json), compiled at once
+    source: path of JSON-file, dict (loaded JSON) or HaxCode
+    Safe for several threads; can be given to worker processes (it pickles with its dialects).
+    '''
+    
+    def __init__(self, sources=None, size=64 << 20):
+        
+        self.size = size # bytes
+        self.used = 0
+        self.codes = collections.OrderedDict() # hash: HaxCode
+        self.names = {} # name: [path or None, hash]
+        self.evicted = {} # hash: path, of evicted dialects that have a JSON-file
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if sources != None:
+            self.preload(sources)
+            
+    def __getstate__(self):
+        
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+        
+    def __setstate__(self, state):
+        
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        
+    def preload(self, sources):
+        '''compiles sources ({name: source} or list of paths) now, not at their first use'''
+        
+        if not isinstance(sources, dict):
+            sources = {os.path.splitext(os.path.basename(p))[0]: p for p in sources}
+        for name, source in sources.items():
+            self.add(name, source)
+            
+    def compile(self, source):
+        '''HaxCode of source, with its hash'''
+        
+        if isinstance(source, HaxCode):
+            code = source
+        elif isinstance(source, dict):
+            code = HaxCode(source)
+        else:
+            code = HaxCode.load(source)
+        if code.hash == None: # not loaded from a file
+            code.hash = hashlib.sha1(json.dumps(code.json, sort_keys=True).encode('utf-8')).hexdigest()
+        return code
+        
+    ENTRY = 256 # bytes per entry of a table (with its compiled and inverted forms) or of a TagCache
+    
+    def estimate(self, code):
+        '''bytes of code: its table entries and the tags in its TagCache, which grows with use'''
+        
+        tables = [code.elementName, code.attributeName, code.value, code.parent, code.hax, code.comma or {}, code.semicolon or {}]
+        return self.ENTRY * (sum(len(T) for T in tables) + len(code.tags.tags))
+        
+    def put(self, code):
+        
+        self.codes.pop(code.hash, None)
+        self.codes[code.hash] = code
+        self.used = sum(self.estimate(C) for C in self.codes.values()) # TagCaches have grown since
+        while self.used > self.size and len(self.codes) > 1: # the newest stays, however large
+            digest, old = self.codes.popitem(last=False)
+            self.used -= self.estimate(old)
+            old.tags.tags.clear() # also of parsers that still use it
+            self.evictions += 1
+            for path, h in self.names.values():
+                if h == digest and path != None: # found by hash too, until it is compiled again
+                    self.evicted[digest] = path
+                    break
+            
+    def add(self, name, source):
+        '''registers (or replaces) dialect name; returns its HaxCode'''
+        
+        code = self.compile(source)
+        with self.lock:
+            self.names[name] = [os.path.abspath(source) if isinstance(source, str) else None, code.hash]
+            self.put(code)
+        return code
+        
+    def get(self, key):
+        '''HaxCode of dialect key: a name or a hash'''
+        
+        with self.lock:
+            entry = self.names.get(key)
+            digest = key if entry == None else entry[1]
+            found = self.codes.get(digest)
+            if found != None:
+                self.codes.move_to_end(digest)
+                self.hits += 1
+                return found
+            self.misses += 1
+            path = entry[0] if entry != None else self.evicted.get(key)
+        if entry == None and path == None:
+            error("Unknown dialect '%s'" % key, fatal=True)
+        if path == None:
+            error("Dialect '%s' was evicted and has no JSON-file: add it again" % key, fatal=True)
+        code = self.compile(path) # evicted: compiled again
+        if entry == None and code.hash != key:
+            error("Dialect '%s' was evicted, and its JSON-file %s has changed since" % (key, path), fatal=True)
+        with self.lock:
+            self.evicted.pop(code.hash, None)
+            for E in self.names.values():
+                if E[0] == path:
+                    E[1] = code.hash
+            self.put(code)
+        return code
+        
+    def __contains__(self, key):
+        
+        return key in self.names or key in self.codes or key in self.evicted
+        
+class FragmentCache():
+    '''
+    parsed fragments of includes, per process (see Haxparser.include), in LRU order:
+    bounded by the number of their nodes, the least recently used are evicted first.
+    key: (path, element at the include); entry: (key of file, nodes, includes, alternating counter after)
+    '''
+    
+    def __init__(self, size=FRAGMENTNODES):
+        
+        self.size = size # nodes
+        self.used = 0
+        self.fragments = collections.OrderedDict()
+        self.lock = threading.Lock() # Converters in several threads
+        
+    def get(self, key):
+        
+        with self.lock:
+            entry = self.fragments.get(key)
+            if entry != None:
+                self.fragments.move_to_end(key)
+            return entry
+        
+    def put(self, key, entry):
+        
+        with self.lock:
+            if key in self.fragments:
+                self.used -= len(self.fragments.pop(key)[1])
+            self.fragments[key] = entry
+            self.used += len(entry[1])
+            while self.used > self.size and len(self.fragments) > 1:
+                self.used -= len(self.fragments.popitem(last=False)[1][1])
+            
+FRAGMENTS = FragmentCache()
 
 class Haxparser():
     
-    def __init__(self, config):
+    def __init__(self, config, code=None, profile=None):
+        '''
+        config: dict like the one made by parseCommandLine(); code: preloaded HaxCode (optional)
+        profile: Profile, records the stages (optional)
+        Without config['haxfile'] nothing is read, parsed or written (see Converter)
+        '''
         
         self.config = config
-        self.void = ['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr']
+        self.profile = profile
+        self.metadata = {}
+        self.outputHash = None # sha1 of written output (of config['format'])
+        self.written = False # False: no output written, or all unchanged
+        self.hashes = {} # output: (sha1, written) of every output
+        self.includes = {} # path: key of every included fragment (see include)
+        self.void = VOID
+        self.errors = None # check mode: list of errors (see check)
         
+        if self.config.get('haxfile') == None:
+            self.config.setdefault('basename', None)
+            self.code = code
+            if profile != None:
+                profile.instrument(self)
+            return
                     
-        self.config['basename'] = os.path.basename(self.config['haxfile'])
-        self.config['dirname'] = os.path.dirname(self.config['haxfile'])
+        if self.config['haxfile'] == '-': # stdin, or config['input'] (see readChunks)
+            self.config.setdefault('basename', '<stdin>')
+            self.config['dirname'] = ''
+        else:
+            self.config['basename'] = os.path.basename(self.config['haxfile'])
+            self.config['dirname'] = os.path.dirname(self.config['haxfile'])
+        if self.config.get('formats'):
+            self.config['format'] = self.config['formats'][0]
                 
         if self.config['verbose']:
             self.printConfig()
             
-        self.loadCode()
+        if code == None:
+            self.loadCode()
+        else:
+            self.code = code
+        if profile != None:
+            profile.instrument(self)
+            nodes = profile.counters['nodes']
+        if self.config.get('check'):
+            self.check()
+            return
+        self.loadTemplate()
+        if self.config.get('stream'):
+            with self.stage('stream') as S:
+                self.stream()
+                if profile != None:
+                    S['bytes'] = self.sourceBytes()
+                    S['nodes'] = profile.counters['nodes'] - nodes
+            if profile != None:
+                for digest, written in self.hashes.values():
+                    profile.count('outputs unchanged' if not written else 'outputs written')
+            return
         self.readSource()
         self.parse()
                 
         if self.config['verbose']:
             for n in self.nodes:
                 print(n)
+        if self.config['wait']: # metadata is known after parsing
+            return
         
-        self.createXML()
-        if self.config['verbose']:
-            print(self.xml)
-        
-        if self.config['format'] in ['html', 'xhtml']:
-            self.collectMetadata()
-        if not self.config['wait']:
-            if self.config['format'] == 'html':
-                self.output = html5(self.xml, self.metadata)
-            elif self.config['format'] == 'xhtml':
-                self.output = xhtml5(self.xml, self.metadata)
-            else:
-                self.output = xml(self.xml)
-            self.writeOutput()
+        for format, output in self.outputs(): # one parse, a serializer per format
+            self.createXML(format)
+            if self.config['verbose']:
+                print(self.xml)
+            
+            self.writeOutput(format, output)
+            if profile != None:
+                profile.count('outputs unchanged' if not self.hashes[output][1] else 'outputs written')
         
     def printConfig(self):
         
@@ -49,146 +491,294 @@ class Haxparser():
         for k in self.config.keys():
             print ('\t%s: %s' % (k, self.config[k]))
             
+    def stage(self, name):
+        '''context of stage name: timed when there is a profile (see Profile.stage)'''
+        
+        if self.profile == None:
+            return NOSTAGE
+        return self.profile.stage(name)
+        
     def loadCode(self):
         
-        p = self.config['code']
-        if not os.path.exists(p):
-            error("Code file '%s' does not exist" % p, fatal=True)
-        try:
-            with open(p) as code:
-                self.code = json.load(code)
-        except json.JSONDecodeError:
-            error("Invalid JSON-file (syntax error)",filepath=p, fatal=True)
+        with self.stage('loadCode') as S:
+            self.code = HaxCode.load(self.config['code'])
+            if self.profile != None and os.path.isfile(self.config['code']):
+                S['bytes'] = os.path.getsize(self.config['code'])
+            
+    def loadTemplate(self):
+        '''
+        self.templates: per format of outputs(), compiled config['template'] (see Template.load),
+        or the built-in template of the format. self.template: of config['format']
+        '''
+        
+        template = Template.load(self.config['template']) if self.config.get('template') else None
+        self.templates = {format: template or TEMPLATES.get(format, TEMPLATES['xml']) for format, output in self.outputs()}
+        self.template = self.templates[self.config['format']]
+        
+    def outputs(self):
+        '''[(format, output)] for every format of config['formats'] (see formatOutputs)'''
+        
+        return formatOutputs(self.config.get('output'), self.config.get('formats') or [self.config['format']])
+        
+    def commit(self, output, out):
+        '''commits Output out of output; records its hash'''
+        
+        digest, written = self.hashes[output] = out.commit()
+        if output == self.config.get('output'):
+            self.outputHash = digest
+        self.written = self.written or written
             
     def readSource(self):
         
         p = self.config['haxfile']
+        if p == '-':
+            with self.stage('readSource') as S:
+                self.source = ''.join(self.readChunks())
+                S['bytes'] = len(self.source)
+            return
+        if not os.path.exists(p):
+            error("File does not exist", filepath=p, fatal=True)
+        if os.path.isdir(p):
+            error("Not a file, but a directory.", filepath=p, fatal=True)
+        
+        with self.stage('readSource') as S:
+            try:
+                with open(p) as source:
+                    self.source = source.read()
+            except:
+                error("Could not read existing haxfile", filepath=p, fatal=True)
+            S['bytes'] = len(self.source)
+            
+    def readChunks(self):
+        '''
+        generator: the haxfile in chunks of CHUNKSIZE characters. Haxfile '-': the chunks of
+        config['input'] (one document of Documents), or of stdin as they arrive (see readStdin)
+        '''
+        
+        p = self.config['haxfile']
+        if p == '-':
+            self.read = 0
+            for chunk in self.config.get('input') or readStdin():
+                self.read += len(chunk)
+                yield chunk
+            return
         if not os.path.exists(p):
             error("File does not exist", filepath=p, fatal=True)
         if os.path.isdir(p):
             error("Not a file, but a directory.", filepath=p, fatal=True)
         
         try:
-            with open(p) as source:
-                self.source = source.read()
+            source = open(p)
         except:
             error("Could not read existing haxfile", filepath=p, fatal=True)
+        with source:
+            chunk = source.read(CHUNKSIZE)
+            while chunk != '':
+                yield chunk
+                chunk = source.read(CHUNKSIZE)
+                
+    def stream(self):
+        '''
+        streaming mode: the haxfile is read in chunks, every node is serialized and written
+        as soon as it is complete. Nor source, nor nodes, nor xml are kept in memory.
+        With several formats (config['formats']) every node goes to a serializer per format.
+        When the head of the template needs the metadata (html and xhtml), the body is spooled
+        to a temporary file, which is copied to the output after parsing.
+        Output is written to a temporary '.part' file: no half-written output on errors,
+        and an output with the same bytes as before is not rewritten (see commitOutput).
+        The compressed variants of config['compress'] are fed at the same time (see Output).
+        '''
+        
+        collector = Metadata()
+        verbose = self.config['verbose']
+        
+        def nodes():
+            feed = collector.feed
+            for N in self.include(self.iterparse(self.readChunks())):
+                if verbose:
+                    print(N)
+                feed(N)
+                yield N
+                
+        if self.config['wait']:
+            for N in nodes():
+                pass
+            self.metadata = collector.metadata
+            return
+            
+        targets = [] # [format, output, Output, spool or None]
+        try:
+            for format, output in self.outputs():
+                template = self.templates[format]
+                out = Output(output, self.config.get('compress'), self.config.get('level'))
+                targets.append([format, output, out, None])
+                if template.metadata: # metadata needed in head: spool body first
+                    targets[-1][3] = tempfile.TemporaryFile('w+', encoding="utf-8")
+                else:
+                    template.segments(template.head, out.write, format, {})
+            serializers = [Serializer((spool or out).write, format, self.config['nocomment']) for format, output, out, spool in targets]
+            dispatch(nodes(), serializers[0] if len(serializers) == 1 else Fanout(serializers))
+            self.metadata = collector.metadata
+            for format, output, out, spool in targets:
+                template = self.templates[format]
+                if spool == None:
+                    template.segments(template.foot, out.write, format, {})
+                else:
+                    spool.seek(0)
+                    writeDocument(out.write, lambda write: shutil.copyfileobj(spool, out), format, self.metadata, template)
+        except BaseException:
+            for T in targets:
+                T[2].abort()
+            raise
+        finally:
+            for T in targets:
+                if T[3] != None:
+                    T[3].close()
+        for format, output, out, spool in targets:
+            self.commit(output, out)
             
-    def collectMetadata(self):
+    def check(self):
+        '''
+        check mode: the haxfile is parsed chunk by chunk, nodes are dropped, nothing is serialized
+        or written. Errors do not stop the parse: every error is collected in self.errors as
+        {'line', 'col', 'message'} (see fail), and the parser recovers:
+            - an unknown short name (element, attribute, value) is kept as it is written
+            - an endtag without starttag is left out
+            - an endtag that does not match closes the open elements up to its starttag, or
+              is left out when there is none
+            - an unclosed quote in a tag is left out
+            - every element that is still open at the end is an error
+        '''
         
-        self.metadata = {'dc:language':'', 'dc:title': ''}
+        self.errors = []
+        with self.stage('check') as S:
+            for N in self.include(self.iterparse(self.readChunks())):
+                pass
+            S['bytes'] = self.sourceBytes()
+            
+    def sourceBytes(self):
+        '''size of the haxfile in bytes; of stdin: the characters read'''
         
-        select = "property"
+        if self.config['haxfile'] == '-':
+            return self.read
+        return os.path.getsize(self.config['haxfile'])
         
-        i = 0
-        while i < len(self.nodes):
-            N = self.nodes[i]
-            if N['type'] == 'starttag' and select in N['attributes']:
-                tagstack = []
-                name = N['attributes'][select]
-                content = ""
-                tagstack.append(N)
-                i += 1
-                while len(tagstack) > 0:
-                    N2 = self.nodes[i]
-                    if N2['type'] == 'starttag':
-                        tagstack.append(N)
-                    elif N2['type'] == 'endtag':
-                        tagstack.pop()
-                    elif N2['type'] == 'text':
-                        content += N2['content']
-                    else:
-                        pass
-                    i += 1
-                content = content.replace('\n', ' ')
-                content = content.replace('\t', ' ')
-                content = content.replace('  ', ' ')
-                self.metadata[name] = content   
-            i += 1      
-                
-    def writeOutput(self):
+    def fail(self, message, position=None):
+        '''error in the haxfile: raises HaxError, or is added to self.errors in check mode'''
+        
+        if self.errors == None:
+            error(message, filepath=self.config['basename'], position=position, fatal=True)
+        line, col = position[:2] if position else (None, None)
+        self.errors.append({'line': line, 'col': col, 'message': message})
+        
+    def writeOutput(self, format=None, output=None):
+        '''
+        writes head, self.xml and foot in sequence to output (default config['output']) in format
+        (default config['format']): the document is never copied as a whole.
+        An output with the same bytes as before is not rewritten (see commitOutput).
+        The compressed variants of config['compress'] are written in the same pass (see Output).
+        '''
         
-        with open(self.config['output'], 'w', encoding="utf-8") as out:
-            out.write(self.output)
+        format = format or self.config['format']
+        output = output or self.config['output']
+        with self.stage('writeOutput') as S:
+            out = Output(output, self.config.get('compress'), self.config.get('level'))
+            try:
+                writeDocument(out.write, self.xml, format, self.metadata, self.templates[format])
+            except BaseException:
+                out.abort()
+                raise
+            self.commit(output, out)
+            S['bytes'] = out.bytes
             
-    def xmlx2node(self, tagnode):
+    def xmlx2node(self, type, tag, start, end):
+        '''
+        Node of xmlx-tag (without < and >) of type 'starttag', 'endtag' or 'empty'
+        start, end: offsets of tag in source
+        A translated tag is kept in the TagCache of the HaxCode: a repeated tag is copied from there
+        '''
         
-        tag = tagnode[1].strip()
+        code = self.code
+        cache = code.tags
+        key = (type, tag, self.config['void'])
+        T = cache.tags.get(key)
+        if T is not None:
+            cache.hits += 1
+            return Node(T[0], start, end, None, T[1], T[2], T[3] and dict(T[3]))
+        cache.misses += 1
+        errors = len(self.errors) if self.errors != None else 0
         
-        NODE = {'type': tagnode[0], 'ns': None, 'name': None, 'position': tagnode[2]}
-        if tagnode[0] != 'endtag':
-            NODE['attributes'] = {}
+        tag = tag.strip()
         
         LIST = ['']
-        QUOTE = False
         DONE = True
         
         j = 0 # counter
-        
-        while j < len(tag):
-            char = tag[j]
-            if QUOTE == False and "hax" in self.code.keys() and char in self.code['hax'].keys():
-                LIST.extend([self.code['hax'][char], "=", ''])
+        n = len(tag)
+        while j < n:
+            m = code.tagscan.search(tag, j)
+            if m == None:
+                LIST[-1] += tag[j:]
+                DONE = False
+                break
+            k = m.start()
+            if k > j:
+                LIST[-1] += tag[j:k]
+                DONE = False
+            char = tag[k]
+            j = k + 1
+            if char in code.hax:
+                LIST.extend([code.hax[char], "=", ''])
                 DONE = True
-            elif QUOTE == False and char == ',' and "comma" in self.code.keys():
-                if LIST[0] in self.code['comma']:
-                    LIST.extend([self.code['comma'][LIST[0]], '=', ''])
+            elif char == ',' and code.comma != None:
+                if LIST[0] in code.comma:
+                    LIST.extend([code.comma[LIST[0]], '=', ''])
                 else:
-                    LIST.extend([self.code['comma']['-'], '=', ''])
+                    LIST.extend([code.comma['-'], '=', ''])
                 DONE = True
-            elif QUOTE == False and char == ';' and "semicolon" in self.code.keys():
-                if LIST[0] in self.code['semicolon']:
-                    LIST.extend([self.code['semicolon'][LIST[0]], '=', ''])
+            elif char == ';' and code.semicolon != None:
+                if LIST[0] in code.semicolon:
+                    LIST.extend([code.semicolon[LIST[0]], '=', ''])
                 else:
-                    LIST.extend([self.code['semicolon']['-'], '=', ''])
+                    LIST.extend([code.semicolon['-'], '=', ''])
                 DONE = True
-            elif char in ['"', "'"]:
-                if QUOTE == False:
-                    QUOTE = char
-                elif QUOTE == char:
-                    QUOTE = False
-                else:
-                    LIST[-1] += char
-                DONE = False
-            elif char in ['=', ' ', '\t', '\n']:
-                if QUOTE == False:
-                    if not DONE:
-                        if char == '=':
-                            LIST.append('=')
-                        LIST.append('')
-                        DONE = True
-                else:
-                    if char in [' ', '\t', '\n']:
-                        LIST[-1] += ' '
-                    else:
-                        LIST[-1] += char
-                    DONE = False
-            else:
-                LIST[-1] += char
+            elif char in ['"', "'"]: # quoted: up to same quote, whitespace becomes space
+                k = tag.find(char, j)
+                if k == -1:
+                    k = n
+                LIST[-1] += tag[j:k].replace('\t', ' ').replace('\n', ' ')
                 DONE = False
-            j += 1
+                j = k + 1
+            else: # '=', ' ', '\t', '\n'
+                if not DONE:
+                    if char == '=':
+                        LIST.append('=')
+                    LIST.append('')
+                    DONE = True
             
         # parsing LIST
+        ns = None
+        attributes = None # only allocated for a tag with attributes
         name = LIST[0]
         if ':' in name:
-            NODE['ns'], name = name.split(':', 1)
+            ns, name = name.split(':', 1)
+            ns = sys.intern(ns)
         if name == name.upper():
             if name.startswith("\\"):
-                NODE['name'] = name[1:]
+                name = sys.intern(name[1:])
             else:
                 try:
-                    EL =  self.code['elementName'][name]
+                    name, attributes = code.elementName[name]
                 except KeyError:
-                    error('%s is not listed in HaXcode as a short name for an element' % name, filepath=self.config['basename'], position=tagnode[2], fatal=True)
-                
-                if isinstance(EL, list):
-                    NODE['name'] = EL[0]
-                    if NODE['type'] != 'endtag':
-                        NODE['attributes'].update(EL[1])
+                    self.fail('%s is not listed in HaXcode as a short name for an element' % name, self.locate(start))
+                    name = sys.intern('\\' + name) # kept as written: its nameless endtag is no second error
+                    
+                if attributes and type != 'endtag':
+                    attributes = dict(attributes)
                 else:
-                    NODE['name'] = EL
+                    attributes = None
         else:
-            NODE['name'] = name
+            name = sys.intern(name)
             
         j = 1
         while j < len(LIST):
@@ -198,9 +788,11 @@ class Haxparser():
                     att = att[1:]
                 else:
                     try:
-                        att = self.code["attributeName"][att]
+                        att = code.attributeName[att]
                     except KeyError:
-                        error('%s is not a short name for attribute' % att, filepath=self.config['basename'], position=tagnode[2], fatal=True)
+                        self.fail('%s is not a short name for attribute' % att, self.locate(start))
+            if attributes == None:
+                attributes = {}
             if j < len(LIST) - 2 and LIST[j+1] == '=':
                 val = LIST[j+2]
                 if val == val.upper(): 
@@ -212,438 +804,3094 @@ class Haxparser():
                         val = val
                     else:
                         try:
-                            val = self.code["value"][val]
+                            val = code.value[val]
                         except KeyError:
-                            error('%s is not known as attribute-value' % val, filepath=self.config['basename'], position=tagnode[2], fatal=True)
+                            self.fail('%s is not known as attribute-value' % val, self.locate(start))
                         
-                if att in NODE['attributes'].keys(): # same att as before
-                    NODE['attributes'][att] += ' %s' % val
+                if att in attributes: # same att as before
+                    attributes[att] += ' %s' % val
                 else:
-                    NODE['attributes'][att] = val
+                    attributes[sys.intern(att)] = val
                 j += 2
             else:
-                NODE['attributes'][att] = "" # boolean
+                attributes[sys.intern(att)] = "" # boolean
             j += 1
         
-        if self.config['void'] and NODE['name'] in self.void:
-            NODE['type'] = 'empty'  
-        return NODE 
+        if self.config['void'] and name in self.void:
+            type = 'empty'  
+        if self.errors == None or len(self.errors) == errors: # a tag with errors is translated again
+            cache.put(key, (type, ns, name, attributes and dict(attributes)))
+        return Node(type, start, end, None, ns, name, attributes)
     
     def parse(self):
         '''
+        parse self.source into self.nodes, collecting self.metadata on the way (see Metadata)
+        With config['parallel'] a large source is parsed by blocks in worker processes (see parseParallel)
+        '''
+        
+        with self.stage('parse') as S:
+            collector = Metadata()
+            feed = collector.feed
+            jobs = self.config.get('jobs') or os.cpu_count() or 1
+            included = self.config.get('include_root') and '<?hax' in self.source # fragments need the open elements
+            if self.config.get('parallel') and jobs > 1 and len(self.source) >= 2 * BLOCKSIZE and not included:
+                self.nodes = nodes = self.parseParallel()
+                for N in nodes:
+                    feed(N)
+            else:
+                self.nodes = nodes = []
+                append = nodes.append
+                parsed = self.iterparse([self.source])
+                if included:
+                    parsed = self.include(parsed)
+                for N in parsed:
+                    feed(N)
+                    append(N)
+            self.metadata = collector.metadata
+            self.lines = None
+            S['bytes'] = len(self.source)
+            S['nodes'] = len(nodes)
+            
+    def include(self, nodes):
+        '''
+        nodes of self.iterparse(), with every <?hax include="file.hax"?> replaced by the nodes of
+        file.hax, a path relative to the directory of the including file. Only with
+        config['include_root']: the path may not be absolute, nor lead outside that directory.
+        Without it, nothing is read and the processing instruction stays as it is.
+        
+        A fragment is parsed in the element that includes it: a tag without name gets its name
+        from that element, and the alternating counter of the element goes on after the fragment.
+        The fragment must close all elements it opens and no others; it may include other
+        fragments, but not itself or a file that includes it.
+        Included nodes get the offsets of the include. Errors in a fragment name the fragment
+        and its line, and the place of the include.
+        
+        A fragment is parsed once per process and kept in FRAGMENTS by path, mtime, size, HaXcode
+        and element (and the fragments it includes): the documents of a batch worker or of the
+        watch mode share it.
+        '''
+        
+        if not self.config.get('include_root'):
+            return nodes
+        return self.expand(nodes)
+        
+    def expand(self, nodes):
+        '''generator: see include'''
+        
+        for N in nodes:
+            if N.type == 'pi' and N.content.startswith('<?hax'):
+                m = INCLUDE.match(N.content)
+                if m != None:
+                    for F in self.fragment(m.group(1) if m.group(1) != None else m.group(2), N):
+                        yield Node(F.type, N.start, N.end, F.content, F.ns, F.name, F.attributes)
+                    continue
+            yield N
+            
+    def fragment(self, name, N):
+        '''nodes of fragment file name, included by node N (see include)'''
+        
+        def where():
+            '''[line, col] of the include'''
+            if getattr(self, 'source', None) != None:
+                return Lines(self.source).position(N.start)
+            return self.locate(N.start)
+            
+        def key(path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return (stat.st_mtime_ns, stat.st_size, self.code.hash, bool(self.config['void']))
+            
+        root = os.path.realpath(self.config['include_root'])
+        path = os.path.realpath(os.path.join(self.config.get('dirname') or root, name))
+        if os.path.isabs(name) or not path.startswith(root + os.sep):
+            self.fail('Included file %s is not in the include root %s' % (name, root), where())
+            return []
+        including = self.config.get('including') or ((os.path.abspath(self.config['haxfile']),) if self.config.get('haxfile') else ())
+        k = key(path)
+        if k == None or not os.path.isfile(path):
+            self.fail('Included file %s does not exist' % name, where())
+            return []
+        tagstack = self.tagstack # of iterparse: the open elements at the include
+        context = tuple(tagstack[-1][:2]) if tagstack else None # element and its alternating counter
+        cached = FRAGMENTS.get((path, context))
+        if cached != None and (cached[0] != k or any(key(p) != pk for p, pk in cached[2].items())): # changed
+            cached = None
+        for p in [path] + (list(cached[2]) if cached != None else []):
+            if p in including:
+                self.fail('Include cycle: %s' % ' -> '.join(os.path.basename(p) for p in including + (path,)), where())
+                return []
+        if cached == None:
+            config = dict(self.config, haxfile=None, basename=os.path.basename(path), dirname=os.path.dirname(path),
+                          including=including + (path,), check=False)
+            P = Haxparser(config, code=self.code)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    P.source = f.read()
+            except (OSError, UnicodeError):
+                self.fail('Could not read included file %s' % name, where())
+                return []
+            try:
+                nodes = list(P.include(P.iterparse([P.source], partial=True, stack=[context] if context else None)))
+                depth = 0
+                for F in nodes:
+                    if F.type == 'starttag':
+                        depth += 1
+                    elif F.type == 'endtag':
+                        depth -= 1
+                        if depth < 0:
+                            P.fail('Endtag closes %s, an element that the included file does not open' % F.name, Lines(P.source).position(F.start))
+                clean, modus, stack = P.endState
+                if not clean:
+                    P.fail('Tag or quote is not closed at the end of the included file')
+                if len(stack) > len(tagstack[-1:]):
+                    P.fail('A starttag (%s) misses corresponding endtag' % stack[-1][0])
+            except HaxError as e:
+                e.message += '\n\tincluded from %s at %d.%d' % ((self.config['basename'],) + tuple(where()))
+                if self.errors == None:
+                    raise
+                self.fail(str(e), where())
+                return []
+            cached = (k, nodes, P.includes, stack[-1][1] if stack else None)
+            FRAGMENTS.put((path, context), cached)
+            if self.profile != None:
+                self.profile.count('fragments parsed')
+        elif self.profile != None:
+            self.profile.count('fragments cached')
+        if context != None:
+            tagstack[-1][1] = cached[3]
+        self.includes[path] = k
+        self.includes.update(cached[2])
+        return cached[1]
+        
+    def parseParallel(self):
+        '''
+        list of nodes of self.source, parsed by top-level blocks in config['jobs'] processes.
+        
+        splitPoints() proposes block boundaries: a '<' at the start of a line, outside comments,
+        CDATA and skip and entities elements. Every block is parsed on its own, as if the
+        document starts there in hax modus; the offsets of its nodes are moved to the document.
+        A block is only used when the previous block ends outside any tag, element or quote
+        in the same modus (see iterparse(partial=True)): then its nodes are exactly those of
+        a sequential parse. Otherwise the block is parsed again, here, from the end of the
+        previous block; after a second miss the rest of the source is parsed sequentially.
+        Errors get the line numbers of the document. With a profile the counters of the blocks
+        that are used (tags, lookups) are added to it, as they would be in a sequential parse.
+        '''
+        
+        source = self.source
+        jobs = self.config.get('jobs') or os.cpu_count() or 1
+        points = splitPoints(source, self.code, max(BLOCKSIZE, len(source) // (4 * jobs)))
+        points.append(len(source))
+        config = dict(self.config)
+        config['haxfile'] = None
+        counted = self.profile != None
+        blocks = [(source[a:b], a, 'hax', config, b == len(source), None, counted) for a, b in zip(points, points[1:])]
+        
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(blocks)), initializer=initWorker, initargs=(self.code,)) as pool:
+            results = list(pool.map(parseBlock, *zip(*blocks)))
+            
+        index = {a: k for k, a in enumerate(points)}
+        nodes = []
+        reparsed = 0
+        R = results[0] # parse from a verified start: begin of source, or clean end of an accepted block
+        while True:
+            if 'error' in R:
+                message, position = R['error']
+                if position:
+                    position = [position[0] + source.count('\n', 0, R['base'])] + position[1:]
+                error(message, filepath=self.config['basename'], position=position, fatal=True)
+            if counted:
+                counters = R['counters']
+            if R['end'] == len(source):
+                nodes.extend(R['nodes'])
+                break
+            clean, modus, stack = R['endState']
+            if not clean or stack: # next boundary was not at top level: parse once more, up to the boundary after it
+                if R.get('merged'):
+                    b = len(source)
+                else:
+                    b = points[index[R['end']] + 1]
+                R = parseBlock(source[R['base']:b], R['base'], R['modus'], config, b == len(source), self.code, counted)
+                R['merged'] = True
+                reparsed += 1
+                continue
+            nodes.extend(R['nodes'])
+            if counted:
+                for name, n in counters.items():
+                    self.profile.count(name, n)
+            k = index[R['end']]
+            if modus == blocks[k][2]:
+                R = results[k]
+            else:
+                R = parseBlock(blocks[k][0], blocks[k][1], modus, config, blocks[k][4], self.code, counted)
+                reparsed += 1
+        if counted:
+            for name, n in counters.items():
+                self.profile.count(name, n)
+            self.profile.count('nodes', len(nodes))
+            self.profile.count('parallel blocks', len(blocks))
+            self.profile.count('parallel reparsed', reparsed)
+        return nodes
+        
+    def position(self, N):
+        '''[line, col, line, col] of start and end of node N in self.source'''
+        
+        if self.lines == None:
+            self.lines = Lines(self.source)
+        return self.lines.position(N.start) + self.lines.position(N.end)
+        
+    def iterparse(self, chunks, modus='hax', partial=False, stack=None):
+        '''
+         generator: yields the nodes (Node) of the source, given as an iterable of string chunks
+         modus: 'hax' or 'xml' at the start of the source
+         partial: the source is a block of a document (see parseParallel): unclosed tags at
+         the end are no error; self.endState is set to (clean, modus, tagstack), clean is True
+         when the block ends outside any tag or quote, tagstack: the elements still open.
+         stack: tagstack at the start of the source (see Session), default: no open elements
+         
          elements tagstack are list like ['p': 0]
          the integer serves as a counter, used in hax2xmlx(): 0 = first child, 1 = second child ...
+         
+         the source is scanned run by run: every state jumps (regex or str.find) to its next
+         significant character and slices the text in between in one step.
+         Nodes keep offsets; line and column are only computed when an error needs a position.
+         
+         Only the unscanned rest of the current chunk is kept in the buffer (source). Until the last
+         chunk is read, scanning stops LOOKAHEAD characters before the end of the buffer, so that
+         every significant character can see the characters that follow it.
         '''
 
-        self.source += '  '
-        entities = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
-        line = 1
-        col = 0
+        chunks = iter(chunks)
+        source = ''
+        final = False
+        n = 0 # end of scannable part of source
+        base = 0 # offset of source in document
+        lines = Lines(source)
+        pinned = [None, None] # offset and [line, col] of start of open tag, no longer in buffer
         state = 'text'
-        modus = 'hax'
         quote = None
-        fragment = ''
-        position = []
-        self.nodes = []
-        tagstack = []
+        fragment = []
+        begin = 0 # offset where fragment begins
+        start = 0 # offset of '<' of current tag
+        tagstack = [list(T) for T in stack] if stack else []
         i = 0
+        more = False # True: need more source before scanning on
+        check = self.errors != None # check mode: errors are collected, tagstack keeps positions
+        
+        def locate(offset):
+            '''[line, col] of offset'''
+            if offset == pinned[0]:
+                return list(pinned[1])
+            return lines.position(offset)
+        self.locate = locate
+        self.tagstack = tagstack # see include
+        
+        code = self.code
+        translated = code.tags.tags # haxtag: xmlx without implied name (see TagCache)
+        put = code.tags.put
         
         def hax2xmlx(haxtag):
             '''convert haxtag to xmlx-starttag'''
-            xmlx = ''
-            markers = [',', ';', '@']
-            markers.extend(self.code['hax'].keys())
-            quote = False
+            
             if len(tagstack) == 0:
                 parent = '-'
             else:
-                if ':' in tagstack[-1][0]:
-                    ns,parent = tagstack[-1][0].split(':')
-                else:
-                    parent = tagstack[-1][0]
-                if parent not in self.code['parent'].keys():
+                parent = tagstack[-1][0]
+                if ':' in parent:
+                    ns,parent = parent.split(':')
+                if parent not in code.parent:
                     parent = '-'
-            
-            j = 0   
-            while j < len(haxtag):
-                char = haxtag[j]
-                if char in markers and xmlx == '': # no name
-                    child = self.code['parent'][parent]
-                    if isinstance(child, str):
-                        xmlx += child
-                    else:
-                        xmlx += child[tagstack[-1][1]]
-                        tagstack[-1][1] += 1
-                        tagstack[-1][1] = tagstack[-1][1] % len(child) # alternating counter
                     
+            def implied():
+                '''name of child of parent, when tag has no name'''
+                child = code.parent[parent]
+                if isinstance(child, str):
+                    return child
+                counter = tagstack[-1][1]
+                tagstack[-1][1] = (counter + 1) % len(child) # alternating counter
+                return child[counter]
+                
+            if haxtag[0] in [' ', '\n', '\t']:
+                return implied()
+            try:
+                xmlx = translated[haxtag]
+            except KeyError:
+                xmlx = scan(haxtag)
+                if xmlx == None: # the tag is translated again: no counter is advanced yet
+                    return None
+                put(haxtag, xmlx)
+            if haxtag[0] in code.markers: # no name
+                return implied() + xmlx
+            return xmlx
+            
+        def scan(haxtag):
+            '''xmlx of haxtag, without the implied name; None if a quote is not closed'''
+            
+            xmlx = []
+            quote = False
+            j = 0
+            while True:
+                m = HAX_NAME_SCAN.search(haxtag, j)
+                if m == None: # unclosed quote
+                    return None
+                k = m.start()
+                xmlx.append(haxtag[j:k])
+                char = haxtag[k]
+                j = k + 1
                 if char in ['"', "'"]:
                     if quote == False:
                         quote = char
                     elif quote == char:
                         quote = False
-                    xmlx += char
-                elif char in [' ', '\n', '\t']:
-                    if quote == False:
-                        if xmlx == '':
-                            child = self.code['parent'][parent] # no name
-                            if isinstance(child, str):
-                                xmlx += child
-                            else:
-                                xmlx += child[tagstack[-1][1]]
-                                tagstack[-1][1] += 1
-                                tagstack[-1][1] = tagstack[-1][1] % len(child) # alternating counter
-                        return xmlx
-                    else:
-                        xmlx += char
+                    xmlx.append(char)
                 elif char == '@':
                     if quote == False:
-                        xmlx += ' '
+                        xmlx.append(' ')
                     else:
-                        xmlx += char
+                        xmlx.append(char)
+                elif quote == False: # whitespace ends name and attributes
+                    return ''.join(xmlx)
                 else:
-                    xmlx += char
-                j += 1
+                    xmlx.append(char)
+                
+        def push(N):
+            if N.ns == None:
+                tagstack.append([N.name, 0])
+            else:
+                tagstack.append(['%s:%s' % (N.ns, N.name), 0])
+            if check:
+                tagstack[-1].append(locate(N.start))
+                
+        def content(N):
+            '''state after a starttag'''
+            if N.name in code.skip:
+                return 'skip'
+            elif N.name in code.entities:
+                return 'entities'
+            return 'text'
             
-        while i < len(self.source) - 2:
-            char = self.source[i]
-            nxt = self.source[i+1]
-            nxt2 = self.source[i+2]
-                        
-            if state=='comment':
-                if  char == '-' and nxt == '-' and nxt2 == '>':
-                    fragment += '-->'
-                    i += 2; col +=2
-                    position.extend([line,col+1])
-                    self.nodes.append({'type': state,'content': fragment, 'position': position})
-                    state = 'text'; fragment = ''
+        while True:
+            if more or i >= n:
+                if final:
+                    break
+                if state != 'text' and start >= base and pinned[0] != start: # open tag leaves buffer
+                    pinned[:] = [start, lines.position(start)]
+                chunk = next(chunks, None)
+                if chunk is None:
+                    final = True
+                    source = source[i:]
+                    n = len(source)
+                    source += '  '
                 else:
-                    fragment += char
-            elif state=='cdata':
-                if char == ']' and nxt == ']' and nxt2 == '>':
-                    fragment += ']]>'
-                    i += 2; col +=2
-                    position.extend([line,col+1])
-                    self.nodes.append({'type': state,'content': fragment, 'position': position})
-                    state = 'text'; fragment = ''
-                else:
-                    fragment += char
-            elif state == 'pi':
-                if char == '?' and nxt == '>':
-                    fragment += '?>'
-                    i += 1; col += 1
-                    position.extend([line,col+1])
-                    self.nodes.append({'type': state,'content': fragment, 'position': position})
-                    state = 'text'; fragment = ''
-                else:
-                    fragment += char
-            elif state == 'declaration':
-                if char == '>':
-                    fragment += '>'
-                    position.extend([line,col+1])
-                    self.nodes.append({'type': state,'content': fragment, 'position': position})
-                    state = 'text'; fragment = ''
-                else:
-                    fragment += char
-            elif state in ['skip', 'entities']:
-                if char == '<' and nxt== '/' and nxt2 == '/':
-                    position.extend([line,col])
-                    self.nodes.append({'type': state,'content': fragment, 'position': position})
-                    fragment = ''
-                    try:
-                        tag = tagstack.pop()
-                    except:
-                        error('Endtag "<//" misses corresponding starttag', filepath=self.config['basename'], position=position, fatal=True)
-                    
-                    if ':' in tag[0]:
-                        ns, name = tag[0].split(':')
-                    else:
-                        name = tag[0]; ns = None
-                    self.nodes.append({'type': 'endtag', 'ns': ns, 'name': name, 'position': [line, col, line, col+3]})
-                    i += 2; col += 2
-                    state = 'text'
-                else:
-                    if state == 'entities' and char in ['<', '>', '&']:
-                        fragment += entities[char]
-                    else:
-                        fragment += char
+                    source = source[i:] + chunk
+                    n = len(source) - LOOKAHEAD
+                base += i
+                lines.feed(source, base)
+                i = 0
+                more = False
             elif state == 'text':
-                if char == '\\' and nxt in ['<', '>', '&']:
-                    fragment += entities[nxt]
-                    i += 1; col += 1
+                m = TEXT_SCAN.search(source, i, n)
+                if m is None:
+                    fragment.append(source[i:n])
+                    i = n
+                    continue
+                j = m.start()
+                if j > i:
+                    fragment.append(source[i:j])
+                char = source[j]
+                nxt = source[j+1]
+                if char == '\\':
+                    if nxt in ENTITIES:
+                        fragment.append(ENTITIES[nxt])
+                        i = j + 2
+                    else:
+                        fragment.append(char)
+                        i = j + 1
                 elif char == '<':
-                    position = [line, col]
-                    if fragment != '':
-                        self.nodes.append({'type': 'text', 'content': fragment})
-                        fragment = ''
+                    start = base + j
+                    if fragment:
+                        yield Node('text', begin, start, ''.join(fragment))
+                        fragment = []
+                    begin = start
                     if nxt == '/':
                         state = 'endtag'
-                        i += 1; col += 1
+                        i = j + 2
                     elif nxt == '!':
-                        fragment += '<!'
+                        nxt2 = source[j+2]
                         if nxt2 == '-':
-                            fragment += '--'
-                            i += 3; col += 3
+                            fragment.append('<!--')
                             state = 'comment'
+                            i = j + 4
                         elif nxt2 == 'D':
-                            fragment += 'DOCTYPE'
-                            i += 8; col += 8
+                            fragment.append('<!DOCTYPE')
                             state = 'declaration'
+                            i = j + 9
                         else:
-                            fragment += '[CDATA['
-                            i += 8; col += 8
+                            fragment.append('<![CDATA[')
                             state = 'cdata'
+                            i = j + 9
                     elif nxt == '?':
-                        fragment += '<?'
+                        fragment.append('<?')
                         state = 'pi'
-                        i += 1; col += 1        
+                        i = j + 2
                     else:
                         state = 'starttag'
-                elif char == '>':
-                    if fragment != '':
-                        self.nodes.append({'type': 'text', 'content':fragment})
-                        fragment = ''
-                    pos = [line, col, line, col + 1]
+                        i = j + 1
+                else: # '>'
+                    if fragment:
+                        yield Node('text', begin, base + j, ''.join(fragment))
+                        fragment = []
+                    i = j + 1
+                    begin = base + i
                     try:
                         tag = tagstack.pop()
                     except:
-                        error('Endtag misses corresponding starttag', filepath=self.config['basename'], position=pos, fatal=True)
-                    self.nodes.append(self.xmlx2node(['endtag', tag[0], pos]))
-                else:
-                    fragment += char
-            elif state == 'endtag': # OK
-                if char == '>':
-                    position.extend([line,col+1])
-                    try:
-                        start = tagstack.pop()
-                    except:
-                        error('Endtag misses corresponding starttag', filepath=self.config['basename'], position=position, fatal=True)
-                    starttag = start[0]
-                    N = self.xmlx2node(['endtag', fragment, position])
-                    if N['ns'] == None:
-                        tag = N['name']
+                        self.fail('Endtag misses corresponding starttag', locate(base + j))
+                        continue
+                    yield self.xmlx2node('endtag', tag[0], base + j, base + j + 1)
+            elif state in CLOSERS: # comment, cdata, pi, declaration
+                closer = CLOSERS[state]
+                j = source.find(closer, i, n)
+                if j == -1:
+                    if final:
+                        k = n
                     else:
-                        tag = '%s:%s' % (N['ns'], N['name'])
-                    if tag != starttag:
-                        error('Endtag "%s" does not match corresponding starttag ("%s")' % (tag, starttag), filepath=self.config['basename'], position=position, fatal=True)
-                    
-                    self.nodes.append(N)
-                    fragment = ''; state = 'text'
+                        k = max(i, n - len(closer) + 1)
+                        more = True
+                    fragment.append(source[i:k])
+                    i = k
+                    continue
+                fragment.append(source[i:j])
+                fragment.append(closer)
+                i = j + len(closer)
+                yield Node(state, start, base + i, ''.join(fragment))
+                state = 'text'; fragment = []
+                begin = base + i
+            elif state in ['skip', 'entities']:
+                j = source.find('<//', i, n)
+                if j == -1:
+                    if final:
+                        k = n
+                    else:
+                        k = max(i, n - 2)
+                        more = True
+                else:
+                    k = j
+                run = source[i:k]
+                if state == 'entities':
+                    run = run.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                fragment.append(run)
+                if j == -1:
+                    i = k
+                    continue
+                yield Node(state, begin, base + j, ''.join(fragment))
+                fragment = []
+                state = 'text'
+                i = j + 3
+                begin = base + i
+                try:
+                    tag = tagstack.pop()
+                except:
+                    self.fail('Endtag "<//" misses corresponding starttag', locate(start))
+                    continue
+                
+                if ':' in tag[0]:
+                    ns, name = tag[0].split(':')
+                else:
+                    name = tag[0]; ns = None
+                yield Node('endtag', base + j, base + j + 3, None, ns, name)
+            elif state == 'endtag':
+                j = source.find('>', i, n)
+                if j == -1:
+                    fragment.append(source[i:n])
+                    i = n
+                    continue
+                fragment.append(source[i:j])
+                tag = ''.join(fragment)
+                fragment = []; state = 'text'
+                i = j + 1
+                begin = base + i
+                try:
+                    opened = tagstack.pop()
+                except:
+                    self.fail('Endtag misses corresponding starttag', locate(start))
+                    continue
+                N = self.xmlx2node('endtag', tag, start, base + j + 1)
+                if N.ns == None:
+                    tag = N.name
+                else:
+                    tag = '%s:%s' % (N.ns, N.name)
+                if tag != opened[0]:
+                    self.fail('Endtag "%s" does not match corresponding starttag ("%s")' % (tag, opened[0]), locate(start))
+                    names = [T[0] for T in tagstack]
+                    if tag not in names: # no starttag: endtag is left out
+                        tagstack.append(opened)
+                        continue
+                    del tagstack[len(names) - 1 - names[::-1].index(tag):] # closes the elements in between
+                
+                yield N
+            else: # starttag
+                if modus == 'xml':
+                    m = XML_TAG_SCAN.search(source, i, n)
+                elif quote == None:
+                    m = HAX_TAG_SCAN.search(source, i, n)
                 else:
-                    fragment += char
-            elif state == 'starttag':
+                    m = QUOTED_TAG_SCAN.search(source, i, n)
+                if m is None:
+                    if final:
+                        k = n
+                    else:
+                        k = max(i, n - 1) # keep a '/' of '/>'
+                        more = True
+                    fragment.append(source[i:k])
+                    i = k
+                    continue
+                j = m.start()
+                if j > i:
+                    fragment.append(source[i:j])
+                char = source[j]
+                i = j + 1
                 if char == '<':
                     if modus == 'hax':
                         modus = 'xml'
                     else:
                         modus = 'hax'
-                elif char == '/' and nxt=='>':
+                elif char == '/': # '/>'
                     state = 'text'
-                    i += 1; col += 1
-                    position.extend([line,col+1])
-                    self.nodes.append(self.xmlx2node(['empty', fragment, position]))
-                    fragment = ''
+                    i = j + 2
+                    yield self.xmlx2node('empty', ''.join(fragment), start, base + i)
+                    fragment = []
+                    begin = base + i
                 elif char == '>':
-                    position.extend([line,col+1])
                     if modus == 'xml':
-                        N = self.xmlx2node(['starttag', fragment, position])
-                        if N['type'] == 'starttag': # not void
-                            if N['ns'] == None:
-                                tagstack.append([N['name'], 0])
-                            else:
-                                tagstack.append(['%s:%s' % (N['ns'], N['name']), 0])
-                        self.nodes.append(N)
+                        N = self.xmlx2node('starttag', ''.join(fragment), start, base + i)
+                        if N.type == 'starttag': # not void
+                            push(N)
                     else:
-                        tag = hax2xmlx(fragment + ' ')
-                        N = self.xmlx2node(['empty', tag, position])
-                        self.nodes.append(N)
-                        
-                    fragment = ''
-                    if N['name'] in self.code['skip']:
-                        state = 'skip'
-                    elif N['name'] in self.code['entities']:
-                        state = 'entities'
-                    else:
-                        state = 'text'
-                    
-                elif char in [' ', '\t', '\n'] and modus == 'hax' and quote == None:
-                    position.extend([line,col])
-                    tag = hax2xmlx(fragment + ' ')
-                    N = self.xmlx2node(['starttag', tag, position])
-                    self.nodes.append(N)
+                        tag = hax2xmlx(''.join(fragment) + ' ')
+                        if tag == None:
+                            self.fail('Quote in tag is not closed', locate(start))
+                            tag = hax2xmlx(re.sub('["\']', '', ''.join(fragment)) + ' ')
+                        N = self.xmlx2node('empty', tag, start, base + i)
+                    yield N
+                    fragment = []
+                    state = content(N)
+                    begin = base + i
+                elif char in [' ', '\t', '\n']: # hax modus, outside quotes
+                    tag = hax2xmlx(''.join(fragment) + ' ')
+                    if tag == None:
+                        self.fail('Quote in tag is not closed', locate(start))
+                        tag = hax2xmlx(re.sub('["\']', '', ''.join(fragment)) + ' ')
+                    N = self.xmlx2node('starttag', tag, start, base + j)
+                    yield N
                     if char == '\n': # for tidy output
-                        self.nodes.append({'type': 'text', 'content': '\n'})
-                    if N['ns'] == None:
-                        tagstack.append([N['name'], 0])
-                    else:
-                        tagstack.append(['%s:%s' % (N['ns'], N['name']), 0])
-                    
-                    fragment = ''
-                    if N['name'] in self.code['skip']:
-                        state = 'skip'
-                    elif N['name'] in self.code['entities']:
-                        state = 'entities'
-                    else:
-                        state = 'text'
-                elif char in ["'", '"'] and modus == 'hax':
+                        yield Node('text', base + j, base + i, '\n')
+                    push(N)
+                    fragment = []
+                    state = content(N)
+                    begin = base + i
+                else: # quote in hax modus
                     if quote == char:
                         quote = None
                     else:
                         quote = char
-                    fragment += char
-                else:
-                    fragment += char
-            else:
-                fragment += char
-            
-            if char == '\n':
-                line += 1; col = 0
-            else:
-                col += 1
-            i += 1
+                    fragment.append(char)
             
+        fragment = ''.join(fragment)
         if fragment != '':
-            self.nodes.append({'type': 'text', 'content': fragment})
+            yield Node('text', begin, base + n, fragment)
             
-        if len(tagstack) != 0:
+        if partial:
+            self.endState = (state == 'text' and quote == None, modus, tagstack)
+        elif check:
+            for T in tagstack:
+                self.fail('A starttag (%s) misses corresponding endtag' % T[0], T[2])
+        elif len(tagstack) != 0:
             error('A starttag (%s) misses corresponding endtag' % tagstack[-1][0], filepath=self.config['basename'], fatal=True)
             
-    def createXML(self):
-        '''
-        when config['format'] == 'html'
-            - html5 output
-            - for browser compatibility, processing instructions are placed inside comment-delimeters <!-- and --> 
-              see: https://developer.mozilla.org/en-US/docs/Web/API/ProcessingInstruction
-              
-            - cdata: kept if embedded in svg- or math-element
-                     otherwise placed inside comment-delimeters
-                     see: https://html.spec.whatwg.org/multipage/syntax.html#cdata-sections
-                          https://w3c.github.io/html-reference/syntax.html#cdata-sections
-        '''
+    def events(self, handler):
+        '''sends the events of self.nodes to handler (see Handler)'''
         
-        self.xml = ''
-        foreign = False
-        for N in self.nodes:
-            if N['type'] in ['text', 'entities', 'skip', 'declaration']:
-                self.xml += N['content']
-            elif N['type'] == 'pi':
-                if self.config['format'] == 'html':
-                    self.xml += '<!-- %s -->' % N['content']
-                else:
-                    self.xml += N['content']
-            elif N['type'] == 'cdata':
-                if self.config['format'] == 'html':
-                    if foreign:
-                        self.xml += N['content']
-                    else:
-                        self.xml += '<!-- %s -->' % N['content']
-                else:
-                    self.xml += N['content']
-            
-            elif N['type'] == 'comment':
-                if self.config['nocomment'] == False:
-                    self.xml += N['content']
-            elif N['type'] == 'endtag':
-                if N['name'] in ['math', 'svg']:
-                    foreign = False 
-                if N['ns'] == None:
-                    self.xml += '</%s>' % N['name']
-                else:
-                    self.xml += '</%s:%s>' % (N['ns'], N['name'])
-            else: # 'starttag' and 'empty
-                if N['name'] in ['math', 'svg']:
-                    foreign = True 
-                if N['ns'] == None:
-                    tag = '<%s' % N['name']
-                else:
-                    tag = '<%s:%s' % (N['ns'], N['name'])
-                for att in N['attributes']:
-                    if N['attributes'][att] == '': # boolean
-                        if self.config['format'] == 'html':
-                            tag += ' %s' % att
-                        else:
-                            tag += ' %s=""' % att
-                            
-                    else:
-                        if '"' in N['attributes'][att]:
-                            tag += " %s='%s'" % (att, N['attributes'][att])
-                        else:
-                            tag += ' %s="%s"' % (att, N['attributes'][att])
-                if N['type'] == 'empty':
-                    if self.config['format'] == 'html':
-                        tag += '>'
-                    else:
-                        tag += ' />'
-                else:
-                    tag += '>'
-                self.xml += tag
-                
-def html5(body, metadata):
+        dispatch(self.nodes, handler)
+        
+    def tree(self, root='body'):
+        '''xml.etree.ElementTree element root with self.nodes as children (see TreeBuilder)'''
+        
+        return tree(self.nodes, root)
+        
+    def createXML(self, format=None):
+        '''serializes self.nodes into self.xml (see Serializer), in format (default config['format'])'''
+        
+        with self.stage('createXML') as S:
+            parts = []
+            Serializer(parts.append, format or self.config['format'], self.config['nocomment']).serialize(self.nodes)
+            self.xml = ''.join(parts)
+            S['bytes'] = len(self.xml)
+            S['nodes'] = len(self.nodes)
+            
+class Node():
+    '''
+    node of a parsed document
     
-    doc = '<!DOCTYPE html>\n'
-    doc += '<html lang="%s">\n<head>\n' % metadata['dc:language']
-    doc += '<title>%s</title>\n' % metadata['dc:title']
-    doc += '<meta charset="utf-8">\n'
-    doc += '<meta name="viewport" content="width=device-width, initial-scale=1.0">\n'
-    doc += '<link rel="stylesheet" href="simple.css">'
-    doc += '<link rel="stylesheet" href="custom-hax.css">'
-    for m in metadata.keys():
-        doc += '<meta name="%s" content="%s">\n' % (m, metadata[m])
-    doc += '</head>\n<body>\n'
-    doc += '''<header>
-    <nav>
-    <a href="../index.html"><img class="icon" src="home.png"> Home</a>
-    <a href="https://github.com/notsue/hax" ><svg class="icon" viewBox="0 0 32 32"><path d="M16 0.395c-8.836 0-16 7.163-16 16 0 7.069 4.585 13.067 10.942 15.182 0.8 0.148 1.094-0.347 1.094-0.77 0-0.381-0.015-1.642-0.022-2.979-4.452 0.968-5.391-1.888-5.391-1.888-0.728-1.849-1.776-2.341-1.776-2.341-1.452-0.993 0.11-0.973 0.11-0.973 1.606 0.113 2.452 1.649 2.452 1.649 1.427 2.446 3.743 1.739 4.656 1.33 0.143-1.034 0.558-1.74 1.016-2.14-3.554-0.404-7.29-1.777-7.29-7.907 0-1.747 0.625-3.174 1.649-4.295-0.166-0.403-0.714-2.030 0.155-4.234 0 0 1.344-0.43 4.401 1.64 1.276-0.355 2.645-0.532 4.005-0.539 1.359 0.006 2.729 0.184 4.008 0.539 3.054-2.070 4.395-1.64 4.395-1.64 0.871 2.204 0.323 3.831 0.157 4.234 1.026 1.12 1.647 2.548 1.647 4.295 0 6.145-3.743 7.498-7.306 7.895 0.574 0.497 1.085 1.47 1.085 2.963 0 2.141-0.019 3.864-0.019 4.391 0 0.426 0.288 0.925 1.099 0.768 6.354-2.118 10.933-8.113 10.933-15.18 0-8.837-7.164-16-16-16z"></path></svg>GitHub</a>
-    </nav>
-    </header>
-    <main>'''
-    doc += body
-    doc += '''</main>
-    <footer>
+    type: 'starttag', 'endtag', 'empty', 'text', 'comment', 'cdata', 'pi', 'declaration', 'skip' or 'entities'
+    start, end: offsets in source (end: just after the node); see Haxparser.position()
+    content: string of nodes that are not tags
+    ns, name: of tags (interned strings)
+    attributes: dict of starttags and empty tags, None when the tag has no attributes
+    '''
+    
+    __slots__ = ['type', 'start', 'end', 'content', 'ns', 'name', 'attributes']
+    
+    def __init__(self, type, start, end, content=None, ns=None, name=None, attributes=None):
+        
+        self.type = type
+        self.start = start
+        self.end = end
+        self.content = content
+        self.ns = ns
+        self.name = name
+        self.attributes = attributes
+        
+    def __eq__(self, other):
+        
+        if not isinstance(other, Node):
+            return NotImplemented
+        return all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+        
+    __hash__ = None
+    
+    def __reduce__(self):
+        '''compact pickle: nodes of a parallel parse come back from worker processes'''
+        
+        return (Node, (self.type, self.start, self.end, self.content, self.ns, self.name, self.attributes))
+    
+    def __repr__(self):
+        
+        fields = ['%s=%r' % (a, getattr(self, a)) for a in self.__slots__[1:] if getattr(self, a) != None]
+        return 'Node(%r, %s)' % (self.type, ', '.join(fields))
+        
+class Metadata():
+    '''
+    collects, node by node, the text content of elements with a property-attribute,
+    while the nodes are parsed. Runs of whitespace in the content become one space.
+    self.metadata: {property: content}
+    '''
+    
+    select = "property"
+    
+    def __init__(self):
+        
+        self.metadata = {'dc:language':'', 'dc:title': ''}
+        self.name = None # property of the element being collected
+        self.depth = 0
+        self.content = []
+        
+    def feed(self, N):
+        
+        if self.name == None:
+            if N.attributes and N.type == 'starttag' and self.select in N.attributes:
+                self.name = N.attributes[self.select]
+                self.depth = 1
+                self.content = []
+        elif N.type == 'starttag':
+            self.depth += 1
+        elif N.type == 'endtag':
+            self.depth -= 1
+            if self.depth == 0:
+                self.metadata[self.name] = ' '.join(''.join(self.content).split())
+                self.name = None
+        elif N.type == 'text':
+            self.content.append(N.content)
+            
+class Handler():
+    '''
+    receiver of the events of dispatch(), SAX-like. Subclass it and override the events you need.
+    ns: prefix or None; attributes: dict, or None for a tag without attributes
+    text: character data as markup (entities like &lt; are escaped)
+    raw: content of skip elements (script, style): not escaped
+    comment, pi, cdata, declaration: content without delimiters (<!-- -->, <? ?>, <![CDATA[ ]]>, <! >)
+    '''
+    
+    def start(self, ns, name, attributes):
+        pass
+        
+    def end(self, ns, name):
+        pass
+        
+    def empty(self, ns, name, attributes):
+        pass
+        
+    def text(self, content):
+        pass
+        
+    def raw(self, content):
+        pass
+        
+    def comment(self, content):
+        pass
+        
+    def pi(self, content):
+        pass
+        
+    def cdata(self, content):
+        pass
+        
+    def declaration(self, content):
+        pass
+        
+def dispatch(nodes, handler):
+    '''calls the events of handler (see Handler) for nodes (iterable of Node), in document order'''
+    
+    start = handler.start
+    end = handler.end
+    empty = handler.empty
+    text = handler.text
+    for N in nodes:
+        t = N.type
+        if t == 'text' or t == 'entities':
+            text(N.content)
+        elif t == 'starttag':
+            start(N.ns, N.name, N.attributes)
+        elif t == 'endtag':
+            end(N.ns, N.name)
+        elif t == 'empty':
+            empty(N.ns, N.name, N.attributes)
+        elif t == 'skip':
+            handler.raw(N.content)
+        elif t == 'comment':
+            handler.comment(N.content[4:-3])
+        elif t == 'cdata':
+            handler.cdata(N.content[9:-3])
+        elif t == 'pi':
+            handler.pi(N.content[2:-2])
+        elif t == 'declaration':
+            handler.declaration(N.content[2:-1])
+            
+class Fanout(Handler):
+    '''sends every event to all handlers: one pass over the nodes for several serializers (see Haxparser.stream)'''
+    
+    def __init__(self, handlers):
+        
+        self.handlers = handlers
+        
+    def start(self, ns, name, attributes):
+        for H in self.handlers:
+            H.start(ns, name, attributes)
+            
+    def end(self, ns, name):
+        for H in self.handlers:
+            H.end(ns, name)
+            
+    def empty(self, ns, name, attributes):
+        for H in self.handlers:
+            H.empty(ns, name, attributes)
+            
+    def text(self, content):
+        for H in self.handlers:
+            H.text(content)
+            
+    def raw(self, content):
+        for H in self.handlers:
+            H.raw(content)
+            
+    def comment(self, content):
+        for H in self.handlers:
+            H.comment(content)
+            
+    def pi(self, content):
+        for H in self.handlers:
+            H.pi(content)
+            
+    def cdata(self, content):
+        for H in self.handlers:
+            H.cdata(content)
+            
+    def declaration(self, content):
+        for H in self.handlers:
+            H.declaration(content)
+            
+class Serializer(Handler):
+    '''
+    writes the events of nodes as xml to write(): list.append, io.StringIO.write, or the write of an open file.
+    Linear in the number of nodes: nothing is concatenated to a growing string.
+    
+    when format == 'html'
+        - html5 output
+        - for browser compatibility, processing instructions are placed inside comment-delimeters <!-- and --> 
+          see: https://developer.mozilla.org/en-US/docs/Web/API/ProcessingInstruction
+          
+        - cdata: kept if embedded in svg- or math-element
+                 otherwise placed inside comment-delimeters
+                 see: https://html.spec.whatwg.org/multipage/syntax.html#cdata-sections
+                      https://w3c.github.io/html-reference/syntax.html#cdata-sections
+    '''
+    
+    def __init__(self, write, format='html', nocomment=False):
+        
+        self.write = write
+        self.html = format == 'html'
+        self.nocomment = nocomment
+        self.foreign = False # inside svg or math
+        self.tags = {} # (ns, name): ['<qname', '</qname>']
+        if self.html:
+            self.boolean = ' %s'
+            self.close = '>'
+        else:
+            self.boolean = ' %s=""'
+            self.close = ' />'
+        self.text = self.raw = write
+        
+    def tag(self, ns, name):
+        '''precomputed prefix of starttag and the endtag of an element'''
+        
+        try:
+            return self.tags[(ns, name)]
+        except KeyError:
+            if ns == None:
+                qname = name
+            else:
+                qname = '%s:%s' % (ns, name)
+            self.tags[(ns, name)] = ['<' + qname, '</%s>' % qname]
+            return self.tags[(ns, name)]
+            
+    def attributes(self, attributes):
+        
+        s = []
+        for att, val in attributes.items():
+            if val == '': # boolean
+                s.append(self.boolean % att)
+            elif '"' in val:
+                s.append(" %s='%s'" % (att, val))
+            else:
+                s.append(' %s="%s"' % (att, val))
+        return ''.join(s)
+        
+    def serialize(self, nodes):
+        
+        dispatch(nodes, self)
+        
+    def start(self, ns, name, attributes):
+        
+        if name in ['math', 'svg']:
+            self.foreign = True
+        tag = self.tag(ns, name)[0]
+        if attributes:
+            tag += self.attributes(attributes)
+        self.write(tag + '>')
+        
+    def empty(self, ns, name, attributes):
+        
+        if name in ['math', 'svg']:
+            self.foreign = True
+        tag = self.tag(ns, name)[0]
+        if attributes:
+            tag += self.attributes(attributes)
+        self.write(tag + self.close)
+        
+    def end(self, ns, name):
+        
+        if name in ['math', 'svg']:
+            self.foreign = False
+        self.write(self.tag(ns, name)[1])
+        
+    def comment(self, content):
+        
+        if self.nocomment == False:
+            self.write('<!--%s-->' % content)
+            
+    def pi(self, content):
+        
+        if self.html:
+            self.write('<!-- <?%s?> -->' % content)
+        else:
+            self.write('<?%s?>' % content)
+            
+    def cdata(self, content):
+        
+        if self.html and not self.foreign:
+            self.write('<!-- <![CDATA[%s]]> -->' % content)
+        else:
+            self.write('<![CDATA[%s]]>' % content)
+            
+    def declaration(self, content):
+        
+        self.write('<!%s>' % content)
+        
+class TreeBuilder(Handler):
+    '''
+    builds an xml.etree.ElementTree element of the events: no serializing and parsing again.
+    The nodes become the children of element root (a document has more top-level elements).
+    Entities in text and attribute values are unescaped; qualified names keep their prefix ('svg:rect').
+    Comments and processing instructions become Comment and ProcessingInstruction elements,
+    cdata becomes text; declarations are left out.
+    '''
+    
+    def __init__(self, root='body'):
+        
+        self.builder = ElementTree.TreeBuilder(insert_comments=True, insert_pis=True)
+        self.builder.start(root, {})
+        self.root = root
+        self.data = self.builder.data
+        
+    def qname(self, ns, name):
+        
+        if ns == None:
+            return name
+        return '%s:%s' % (ns, name)
+        
+    def start(self, ns, name, attributes):
+        
+        if attributes:
+            attributes = {att: html.unescape(val) for att, val in attributes.items()}
+        self.builder.start(self.qname(ns, name), attributes or {})
+        
+    def end(self, ns, name):
+        
+        self.builder.end(self.qname(ns, name))
+        
+    def empty(self, ns, name, attributes):
+        
+        self.start(ns, name, attributes)
+        self.end(ns, name)
+        
+    def text(self, content):
+        
+        if '&' in content:
+            content = html.unescape(content)
+        self.data(content)
+        
+    def raw(self, content):
+        
+        self.data(content)
+        
+    def cdata(self, content):
+        
+        self.data(content)
+        
+    def comment(self, content):
+        
+        self.builder.comment(content)
+        
+    def pi(self, content):
+        
+        target, _, text = content.partition(' ')
+        self.builder.pi(target, text)
+        
+    def close(self):
+        '''the root element'''
+        
+        self.builder.end(self.root)
+        return self.builder.close()
+        
+def tree(nodes, root='body'):
+    '''xml.etree.ElementTree element root with nodes as children (see TreeBuilder)'''
+    
+    builder = TreeBuilder(root)
+    dispatch(nodes, builder)
+    return builder.close()
+    
+class Encoder(Handler):
+    '''
+    writes the events (see Handler) of a document as HaX to write(): the reverse of Haxparser.
+    Uses the inverted tables of HaxCode, so the HaX is as short as the code allows:
+        - short names of elements (with their attributes), attributes and values
+        - markers of hax, comma and semicolon (.x#y,href;target), a class "a b" as .a.b
+        - no name when the parent implies it (alternating children counted like Haxparser does)
+        - nameless endtags '>', and '<//' after skip and entities elements
+    Haxparser turns the HaX into the same events again. What HaX can not express is written
+    as its nearest equivalent: < and > in text become &lt; and &gt;, a backslash before an
+    entity (or at the end of a text) becomes &#92;, references in entities elements become
+    characters, tab and newline in an attribute-value a space, a value of only spaces is empty.
+    Elements, comments, or '<//' in skip and entities elements raise HaxError.
+    
+    Nothing but the open elements, the current text and a tag waiting for its first content
+    is kept: write() gets the HaX event by event. Call close() after the last event.
+    '''
+    
+    TEXT = re.compile(r'&(?:lt|gt|amp);|[<>]|\\+(?=&(?!lt;|gt;|amp;)|\Z)')
+    ESCAPES = {'&lt;': '\\<', '&gt;': '\\>', '&amp;': '\\&', '<': '\\<', '>': '\\>'}
+    QUOTES = {'"': '\'"\'""', "'": '"\'"\'\''}
+    
+    def __init__(self, write, code):
+    
+        self.write = write
+        self.code = code
+        self.stack = [] # open elements: [name, counter of alternating children, state, endtag]
+        self.pending = None # starttag, written with the first content: a newline ends it
+        self.modus = 'hax'
+        self.buffer = [] # text up to next tag
+        self.text = self.raw = self.buffer.append
+        self.shorthands = {} # element name as written: {attribute: marker}
+        self.values = {} # value: shortest form
+        
+    def shorthand(self, written):
+        '''{attribute: marker} in tags of element written (name as written in the tag)'''
+        
+        try:
+            return self.shorthands[written]
+        except KeyError:
+            pass
+        code = self.code
+        markers = dict(code.marker)
+        for char, table in [(',', code.comma), (';', code.semicolon)]:
+            if table != None and char not in code.hax:
+                att = table.get(written, table.get('-'))
+                if att != None:
+                    markers.setdefault(att, char)
+        self.shorthands[written] = markers
+        return markers
+        
+    def implied(self):
+        '''(name Haxparser gives to a tag without name here or None, alternating children or None)'''
+        
+        parent = '-'
+        if self.stack and self.stack[-1][0] in self.code.parent:
+            parent = self.stack[-1][0]
+        child = self.code.parent.get(parent)
+        if child == None or isinstance(child, str):
+            return child, None
+        if not self.stack:
+            return None, None
+        return child[self.stack[-1][1]], child
+        
+    def value(self, val):
+        '''shortest form of attribute-value val'''
+        
+        try:
+            return self.values[val]
+        except KeyError:
+            pass
+        v = val.replace('<', '&lt;').replace('>', '&gt;').replace('\t', ' ').replace('\n', ' ')
+        if v.strip() == '':
+            v = '' # boolean
+        elif v == v.upper() and v[0] not in '0123456789':
+            v = '\\' + v
+        if '"' in v or "'" in v: # runs, a quote as '"'"" or "'"'': the tag scanner of Haxparser needs pairs
+            v = ''.join(self.QUOTES.get(run, run if self.code.special.search(run) == None else '"%s"' % run) for run in re.split('(["\'])', v) if run)
+        elif v == '' or self.code.special.search(v) != None:
+            v = '"%s"' % v
+        short = self.code.shortValue.get(val)
+        if short != None and len(short) < len(v):
+            v = short
+        if len(self.values) > 4096:
+            self.values.clear()
+        self.values[val] = v
+        return v
+        
+    def attribute(self, att, val, markers):
+        '''shortest hax of attribute att with value val'''
+        
+        if val.strip() == '': # boolean
+            val = ''
+        marker = markers.get(att)
+        if marker != None:
+            if val == '':
+                return marker + '""'
+            hax = marker + self.value(val)
+            parts = val.split(' ')
+            if len(parts) > 1 and '' not in parts: # like .a.b for class="a b"
+                split = ''.join(marker + self.value(v) for v in parts)
+                if len(split) < len(hax):
+                    hax = split
+            return hax
+        name = self.code.shortAttribute.get(att)
+        if name == None:
+            name = self.name(att, 'attribute')
+        if val == '':
+            return '@' + name
+        return '@%s=%s' % (name, self.value(val))
+        
+    def name(self, name, what):
+        '''name as written in a tag'''
+        
+        if name == '' or self.code.special.search(name) != None or '"' in name or "'" in name:
+            error('%s name "%s" can not be encoded in HaX' % (what, name), fatal=True)
+        if name == name.upper():
+            return '\\' + name
+        return name
+        
+    def attributes(self, written, defaults, attributes):
+        '''hax of attributes after element name written, with defaults of its short name; None if defaults do not fit'''
+        
+        markers = self.shorthand(written)
+        items = list(attributes.items())
+        hax = []
+        if defaults:
+            if len(items) < len(defaults):
+                return None
+            for (att, val), (default, dval) in zip(items, defaults.items()):
+                if att != default:
+                    return None
+                if val != dval:
+                    if not val.startswith(dval + ' '):
+                        return None
+                    hax.append(self.attribute(att, val[len(dval)+1:], markers)) # appended to default
+            items = items[len(defaults):]
+        for att, val in items:
+            hax.append(self.attribute(att, val, markers))
+        return ''.join(hax)
+        
+    def tag(self, ns, name, attributes, elide=True):
+        '''shortest hax-tag (without '<' and end) of element'''
+        
+        attributes = attributes or {}
+        prefix = '' if ns == None else ns + ':'
+        candidates = [(prefix + self.name(name, 'element'), None)]
+        for short, defaults in self.code.shortElement.get(name, []):
+            candidates.append((prefix + short, defaults))
+        best = None
+        for written, defaults in candidates:
+            hax = self.attributes(written, defaults, attributes)
+            if hax != None and (best == None or len(written) + len(hax) < len(best)):
+                best = written + hax
+        implied, alternating = self.implied()
+        if elide and ns == None and implied == name:
+            hax = self.attributes(name, None, attributes)
+            if hax[:1] not in ['!', '?', '/'] and len(hax) < len(best): # '<!', '<?', '</' start other tags
+                best = hax
+                if alternating != None:
+                    self.stack[-1][1] = (self.stack[-1][1] + 1) % len(alternating)
+        return best
+        
+    def open(self, modus):
+        '''start of a tag in modus: '<<' switches modus'''
+        
+        if modus == self.modus:
+            return '<'
+        self.modus = modus
+        return '<<'
+        
+    def state(self):
+    
+        return self.stack[-1][2] if self.stack else 'text'
+        
+    def flush(self):
+        '''writes the pending starttag and the text'''
+        
+        content = ''.join(self.buffer)
+        self.buffer.clear()
+        if self.pending != None:
+            if content.startswith('\n'): # newline ends starttag, and is text
+                self.write(self.pending + '\n')
+                content = content[1:]
+            else:
+                self.write(self.pending + ' ')
+            self.pending = None
+        if content == '':
+            return
+        state = self.state()
+        if state == 'text':
+            self.write(self.TEXT.sub(lambda m: self.ESCAPES.get(m.group(), '&#92;' * len(m.group())), content))
+        else:
+            if state == 'entities':
+                content = html.unescape(content)
+            if '<//' in content:
+                error('"<//" in %s element can not be encoded in HaX' % self.stack[-1][0], fatal=True)
+            self.write(content)
+            
+    def markup(self, what):
+        '''flushes before a tag, comment, pi, cdata or declaration'''
+        
+        self.flush()
+        if self.state() != 'text':
+            error('%s in %s element can not be encoded in HaX' % (what, self.stack[-1][0]), fatal=True)
+            
+    def start(self, ns, name, attributes):
+    
+        self.markup('element')
+        self.pending = self.open('hax') + self.tag(ns, name, attributes)
+        if name in self.code.skip:
+            state = 'skip'
+        elif name in self.code.entities:
+            state = 'entities'
+        else:
+            state = 'text'
+        endtag = '>'
+        if name == name.upper(): # '>' would look up name as a short name
+            endtag = '</%s>' % self.name(name, 'element') if ns == None else '</%s:%s>' % (ns, self.name(name, 'element'))
+        self.stack.append([name, 0, state, endtag])
+        
+    def empty(self, ns, name, attributes):
+    
+        self.markup('element')
+        if name in self.code.skip or name in self.code.entities: # '>' would start their content: '/>' ends the tag
+            tag = self.tag(ns, name, attributes, elide=False)
+            xmlx = re.sub(r'("[^"]*"|\'[^\']*\')|@', lambda m: m.group(1) or ' ', tag)
+            if xmlx == tag:
+                self.write(self.open('hax') + tag + '/>')
+            else: # xml modus: no whitespace ends the tag
+                self.write(self.open('xml') + xmlx + '/>')
+        else:
+            tag = self.tag(ns, name, attributes)
+            if tag.endswith('/'): # '/>' would end the tag
+                tag += '""'
+            self.write(self.open('hax') + tag + '>')
+                
+    def end(self, ns, name):
+    
+        self.flush()
+        element = self.stack.pop()
+        if element[2] == 'text':
+            self.write(element[3])
+        else:
+            self.write('<//')
+            
+    def comment(self, content):
+    
+        self.markup('comment')
+        self.write('<!--%s-->' % content)
+        
+    def pi(self, content):
+    
+        self.markup('processing instruction')
+        self.write('<?%s?>' % content)
+        
+    def cdata(self, content):
+    
+        self.markup('cdata')
+        self.write('<![CDATA[%s]]>' % content)
+        
+    def declaration(self, content):
+    
+        self.markup('declaration')
+        if content[:7].upper() != 'DOCTYPE':
+            error('declaration <!%s> can not be encoded in HaX' % content, fatal=True)
+        self.write('<!DOCTYPE%s>' % content[7:])
+        
+    def close(self):
+    
+        self.flush()
+        if self.stack:
+            error('Element %s is not closed' % self.stack[-1][0], fatal=True)
+            
+class MarkupParser(html.parser.HTMLParser):
+    '''
+    sends the events (see Handler) of html or xml markup to handler: feed() the markup in chunks,
+    then close(). The events are those Haxparser makes of the same document:
+        - text is markup: entity and character references are kept
+        - attribute-values are escaped again (html.parser unescapes them)
+        - names keep their case; a prefix becomes ns ('svg:rect')
+        - void elements of html5 (<br>) are empty
+        - an element without endtag is closed by the endtag of its parent, like a browser does;
+          endtags without starttag are left out
+    '''
+    
+    def __init__(self, handler):
+    
+        super().__init__(convert_charrefs=False)
+        self.handler = handler
+        self.open = [] # (ns, name) of open elements
+        
+    def element(self, tag):
+        '''(ns, name, attribute names) of the starttag, in the case of the source'''
+        
+        source = self.get_starttag_text()
+        names = {}
+        if source != source.lower():
+            tag = re.match(r'<\s*([^\s/>]+)', source).group(1)
+            for att in re.findall(r'[\s/]([^\s/>"\'=]+)', re.sub(r'"[^"]*"|\'[^\']*\'', ' ', source[len(tag)+1:])):
+                names.setdefault(att.lower(), att)
+        if ':' in tag:
+            ns, tag = tag.split(':', 1)
+            return ns, tag, names
+        return None, tag, names
+        
+    def attributes(self, attrs, names):
+    
+        if not attrs:
+            return None
+        attributes = {}
+        for att, val in attrs:
+            att = names.get(att, att)
+            if att in attributes:
+                continue
+            if val == None:
+                val = ''
+            else:
+                val = val.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                if '"' in val and "'" in val:
+                    val = val.replace('"', '&quot;')
+            attributes[att] = val
+        return attributes
+        
+    def handle_starttag(self, tag, attrs):
+    
+        ns, name, names = self.element(tag)
+        attributes = self.attributes(attrs, names)
+        if ns == None and name.lower() in VOID:
+            self.handler.empty(ns, name, attributes)
+        else:
+            self.handler.start(ns, name, attributes)
+            self.open.append((ns, name))
+            
+    def handle_startendtag(self, tag, attrs):
+    
+        ns, name, names = self.element(tag)
+        self.handler.empty(ns, name, self.attributes(attrs, names))
+        
+    def handle_endtag(self, tag):
+    
+        for k in range(len(self.open) - 1, -1, -1):
+            ns, name = self.open[k]
+            if (name if ns == None else '%s:%s' % (ns, name)).lower() == tag:
+                while len(self.open) > k:
+                    self.handler.end(*self.open.pop())
+                return
+                
+    def handle_data(self, data):
+    
+        if self.open and self.open[-1][1].lower() in self.CDATA_CONTENT_ELEMENTS:
+            self.handler.raw(data)
+        else:
+            self.handler.text(data)
+            
+    def handle_entityref(self, name):
+    
+        self.handler.text('&%s;' % name)
+        
+    def handle_charref(self, name):
+    
+        self.handler.text('&#%s;' % name)
+        
+    def handle_comment(self, data):
+    
+        self.handler.comment(data)
+        
+    def handle_decl(self, decl):
+    
+        self.handler.declaration(decl)
+        
+    def handle_pi(self, data):
+    
+        self.handler.pi(data[:-1] if data.endswith('?') else data)
+        
+    def unknown_decl(self, data):
+    
+        if data.startswith('CDATA['):
+            self.handler.cdata(data[6:])
+        else:
+            self.handler.declaration(data)
+            
+    def close(self):
+    
+        super().close()
+        while self.open:
+            self.handler.end(*self.open.pop())
+            
+def encodeChunks(chunks, code, write):
+    '''writes html or xml markup, given as an iterable of string chunks, as HaX to write() (see Encoder)'''
+    
+    encoder = Encoder(write, code)
+    parser = MarkupParser(encoder)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+        encoder.close()
+    except HaxError as e:
+        if e.position == None:
+            e.position = list(parser.getpos())
+        raise
+    
+class Lines():
+    '''
+    newline index of a source: line and column of an offset, computed on demand.
+    Offsets are mostly asked in increasing order, so only the newlines between
+    the previous and the current offset are counted.
+    In streaming mode the source is a buffer: feed() moves it along the document.
+    '''
+    
+    def __init__(self, source):
+        
+        self.source = source
+        self.base = 0 # offset of source in document
+        self.offset = 0
+        self.line = 1
+        self.start = 0 # offset of first character of self.line
+        
+    def feed(self, source, base):
+        '''continue with buffer source, starting at offset base of the document'''
+        
+        self.position(base)
+        self.source = source
+        self.base = base
+        
+    def position(self, offset):
+        '''[line, col] of offset'''
+        
+        if offset < self.offset: # only when the whole document is in source
+            self.offset = 0; self.line = 1; self.start = 0
+        a = self.offset - self.base
+        b = offset - self.base
+        self.line += self.source.count('\n', a, b)
+        nl = self.source.rfind('\n', a, b)
+        if nl != -1:
+            self.start = self.base + nl + 1
+        self.offset = offset
+        return [self.line, offset - self.start]
+        
+class CountedTable(dict):
+    '''lookup table of HaxCode that counts its lookups in counters[name] (see Profile)'''
+    
+    def __init__(self, table, counters, name):
+        
+        dict.__init__(self, table)
+        self.counters = counters
+        self.name = name
+        
+    def __getitem__(self, key):
+        
+        self.counters[self.name] += 1
+        return dict.__getitem__(self, key)
+        
+    def __contains__(self, key):
+        
+        self.counters[self.name] += 1
+        return dict.__contains__(self, key)
+        
+class Profile():
+    '''
+    wall time, bytes and nodes of the stages of Haxparser, and counters of hot operations:
+    nodes, tags (xmlx2node calls), tags found in the TagCache, lookups in the tables of HaxCode
+    (of tags that were not cached), errors and outputs.
+    Bytes are the characters of source and xml, and the size of input and output files.
+    
+        profile = Profile()
+        Haxparser(config, profile=profile)
+        print(profile.json())
+        
+    A Haxparser without profile is not instrumented: its stages are entered in a shared
+    null context and nothing is counted. One Profile can collect several runs (not from
+    several threads at once); merge() adds the report of a run in another process.
+    '''
+    
+    TABLES = ['hax', 'comma', 'semicolon', 'value', 'attributeName', 'elementName', 'parent']
+    
+    def __init__(self):
+        
+        self.stages = {} # name: {'seconds', 'calls', 'bytes', 'nodes'}
+        self.counters = {'nodes': 0, 'tags': 0, 'tags cached': 0, 'errors': 0}
+        
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''times the with-block; the block may set 'bytes' and 'nodes' in the yielded dict'''
+        
+        record = {}
+        start = time.perf_counter()
+        try:
+            yield record
+        except HaxError:
+            self.count('errors')
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            S = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0, 'nodes': 0})
+            S['seconds'] += seconds
+            S['calls'] += 1
+            S['bytes'] += record.get('bytes', 0)
+            S['nodes'] += record.get('nodes', 0)
+            
+    def count(self, name, n=1):
+        
+        self.counters[name] = self.counters.get(name, 0) + n
+        
+    def instrument(self, parser):
+        '''counts nodes, tags and HaxCode lookups of parser (Haxparser)'''
+        
+        counters = self.counters
+        code = copy.copy(parser.code)
+        code.tags = parser.code.tags # not a copy: the cache of all parsers of the HaXcode
+        for table in self.TABLES:
+            if getattr(code, table) != None:
+                name = 'lookup.%s' % table
+                counters.setdefault(name, 0)
+                setattr(code, table, CountedTable(getattr(code, table), counters, name))
+        parser.code = code
+        
+        iterparse = parser.iterparse
+        def countNodes(*args, **kwargs):
+            for N in iterparse(*args, **kwargs):
+                counters['nodes'] += 1
+                yield N
+        parser.iterparse = countNodes
+        
+        xmlx2node = parser.xmlx2node
+        cache = code.tags
+        def countTags(*args):
+            counters['tags'] += 1
+            hits = cache.hits
+            N = xmlx2node(*args)
+            counters['tags cached'] += cache.hits - hits
+            return N
+        parser.xmlx2node = countTags
+        
+    def merge(self, report):
+        '''adds report (see report()) of another Profile'''
+        
+        for name, R in report['stages'].items():
+            S = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0, 'nodes': 0})
+            for k in S:
+                S[k] += R[k]
+        for name, n in report['counters'].items():
+            self.count(name, n)
+            
+    def report(self):
+        '''dict of stages (with MB/s and nodes/s) and counters'''
+        
+        stages = {}
+        for name, S in self.stages.items():
+            R = stages[name] = dict(S)
+            if S['seconds'] > 0:
+                R['MB/s'] = S['bytes'] / S['seconds'] / 1e6
+                R['nodes/s'] = S['nodes'] / S['seconds']
+        return {'seconds': sum(S['seconds'] for S in self.stages.values()), 'stages': stages, 'counters': dict(self.counters)}
+        
+    def json(self):
+        
+        return json.dumps(self.report(), indent=2)
+        
+NOSTAGE = contextlib.nullcontext({}) # stage of a Haxparser without Profile
+                
+class Template():
+    '''
+    page around the body of a document, compiled once into static segments and slots:
+        {{body}}: the converted document (exactly once)
+        {{meta}}: a meta-element for every item of the metadata (see Metadata)
+        {{name}}: the metadata of property name, like {{dc:title}} ('' when unknown)
+    Head and foot are written segment by segment; static text is never rebuilt.
+    
+    Template.load() keeps compiled template files per process: a batch worker or the watch
+    mode compiles a template once, and again only when its file changes.
+    '''
+    
+    SLOT = re.compile(r'\{\{\s*([^{}\s]+)\s*\}\}')
+    LOADED = {} # path: ((mtime, size), Template)
+    
+    def __init__(self, text, path=None):
+        
+        self.path = path
+        self.hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        self.head = segments = [] # strings, and slots: tuple (name,)
+        self.foot = None
+        i = 0
+        for m in self.SLOT.finditer(text):
+            if m.start() > i:
+                segments.append(text[i:m.start()])
+            i = m.end()
+            if m.group(1) != 'body':
+                segments.append((m.group(1),))
+            elif self.foot == None:
+                self.foot = segments = []
+            else:
+                error('{{body}} occurs more than once in template', filepath=path, fatal=True)
+        if i < len(text):
+            segments.append(text[i:])
+        if self.foot == None:
+            error('Template has no {{body}}', filepath=path, fatal=True)
+        self.metadata = any(isinstance(S, tuple) for S in self.head) # head needs the metadata of the document
+    
+    @classmethod
+    def load(cls, path):
+        '''compiled template of file path'''
+        
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            error("Template does not exist", filepath=path, fatal=True)
+        key = (stat.st_mtime_ns, stat.st_size)
+        loaded = cls.LOADED.get(path)
+        if loaded != None and loaded[0] == key:
+            return loaded[1]
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeError):
+            error("Could not read template", filepath=path, fatal=True)
+        template = cls(text, path)
+        cls.LOADED[path] = (key, template)
+        return template
+    
+    def segments(self, segments, write, format, metadata):
+        
+        for S in segments:
+            if S.__class__ is str:
+                write(S)
+            elif S[0] == 'meta':
+                close = '>' if format == 'html' else ' />'
+                for m in metadata.keys():
+                    write('<meta name="%s" content="%s"%s\n' % (m, metadata[m], close))
+            else:
+                write(metadata.get(S[0], ''))
+    
+    def write(self, write, body, format='html', metadata={}):
+        '''
+        writes head, body and foot in sequence to write()
+        body: a string, or a callable that writes the body with write()
+        '''
+        
+        self.segments(self.head, write, format, metadata)
+        if callable(body):
+            body(write)
+        else:
+            write(body)
+        self.segments(self.foot, write, format, metadata)
+    
+    def render(self, segments, format, metadata):
+        
+        out = []
+        self.segments(segments, out.append, format, metadata)
+        return ''.join(out)
+    
+# built-in templates, per format
+TEMPLATES = {
+'html': Template('''<!DOCTYPE html>
+<html lang="{{dc:language}}">
+<head>
+<title>{{dc:title}}</title>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<link rel="stylesheet" href="simple.css"><link rel="stylesheet" href="custom-hax.css">{{meta}}</head>
+<body>
+<header>
+    <nav>
+    <a href="../index.html"><img class="icon" src="home.png"> Home</a>
+    <a href="https://github.com/notsue/hax" ><svg class="icon" viewBox="0 0 32 32"><path d="M16 0.395c-8.836 0-16 7.163-16 16 0 7.069 4.585 13.067 10.942 15.182 0.8 0.148 1.094-0.347 1.094-0.77 0-0.381-0.015-1.642-0.022-2.979-4.452 0.968-5.391-1.888-5.391-1.888-0.728-1.849-1.776-2.341-1.776-2.341-1.452-0.993 0.11-0.973 0.11-0.973 1.606 0.113 2.452 1.649 2.452 1.649 1.427 2.446 3.743 1.739 4.656 1.33 0.143-1.034 0.558-1.74 1.016-2.14-3.554-0.404-7.29-1.777-7.29-7.907 0-1.747 0.625-3.174 1.649-4.295-0.166-0.403-0.714-2.030 0.155-4.234 0 0 1.344-0.43 4.401 1.64 1.276-0.355 2.645-0.532 4.005-0.539 1.359 0.006 2.729 0.184 4.008 0.539 3.054-2.070 4.395-1.64 4.395-1.64 0.871 2.204 0.323 3.831 0.157 4.234 1.026 1.12 1.647 2.548 1.647 4.295 0 6.145-3.743 7.498-7.306 7.895 0.574 0.497 1.085 1.47 1.085 2.963 0 2.141-0.019 3.864-0.019 4.391 0 0.426 0.288 0.925 1.099 0.768 6.354-2.118 10.933-8.113 10.933-15.18 0-8.837-7.164-16-16-16z"></path></svg>GitHub</a>
+    </nav>
+    </header>
+    <main>{{body}}</main>
+    <footer>
      <p><img width="40" height="40" src="cc.svg"> <img width="40" height="40" src="by.svg"></p>
       <p>Content on this site is licensed under a <a href="https://creativecommons.org/licenses/by/4.0/">Creative Commons Attribution 4.0 International license</a></p>
     <p>Style is managed with: <a href="https://simplecss.org/">simple.css</a> | icons from <a href="https://pictogrammers.com/">Pictogrammers</a></p>
   </footer>
-  '''
-    doc += '</body>\n</html>\n'
-    return doc
+  </body>
+</html>
+'''),
+'xhtml': Template('''<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{{dc:language}}">
+<head>
+<title>{{dc:title}}</title>
+{{meta}}<style>
+    
+    </style></head>
+<body>
+{{body}}</body>
+</html>
+'''),
+'xml': Template('''<?xml version="1.0" encoding="utf-8"?>
+{{body}}''')}
+
+def html5(body, metadata):
+    
+    return html5head(metadata) + body + html5foot()
+    
+def html5head(metadata):
+    
+    return TEMPLATES['html'].render(TEMPLATES['html'].head, 'html', metadata)
+    
+def html5foot():
+    
+    return TEMPLATES['html'].render(TEMPLATES['html'].foot, 'html', {})
+    
+def xhtml5(body,metadata):
+    
+    return xhtml5head(metadata) + body + xhtml5foot()
+    
+def xhtml5head(metadata):
+    
+    return TEMPLATES['xhtml'].render(TEMPLATES['xhtml'].head, 'xhtml', metadata)
+    
+def xhtml5foot():
+    
+    return TEMPLATES['xhtml'].render(TEMPLATES['xhtml'].foot, 'xhtml', {})
+    
+def xml(body):
+    
+    return xmlhead() + body
+    
+def xmlhead(metadata=None):
+    
+    return TEMPLATES['xml'].render(TEMPLATES['xml'].head, 'xml', metadata or {})
+    
+def writeDocument(write, body, format='html', metadata={}, template=None):
+    '''
+    writes head, body and foot of template (default: the built-in template of format) in sequence to write()
+    body: a string, or a callable that writes the body with write()
+    '''
+    
+    if template == None:
+        template = TEMPLATES.get(format, TEMPLATES['xml'])
+    template.write(write, body, format, metadata)
+    
+class HaxError(Exception):
+    '''
+    fatal error in a haxfile or HaXcode
+    position: [line, col, ...] (line 1, col 0 is start of file) or None
+    '''
+    
+    def __init__(self, message, filepath=None, position=None):
+        
+        Exception.__init__(self, message)
+        self.message = message
+        self.filepath = filepath
+        self.position = position
+        
+    @property
+    def line(self):
+        
+        if self.position:
+            return self.position[0]
+        
+    @property
+    def col(self):
+        
+        if self.position:
+            return self.position[1]
+        
+    def report(self, warning=False):
+        '''message as printed by the command line'''
+        
+        if warning:
+            s = '\n\tWARNING: '
+        else:
+            s = '\n\tERROR: '
+        if self.filepath:
+            s += 'in %s ' % self.filepath
+        if self.position:
+            s += 'at %d.%d' % (self.position[0], self.position[1])
+        s += '\n\t%s' % self.message
+        return s
+        
+    def __str__(self):
+        
+        s = ''
+        if self.filepath:
+            s += '%s:' % self.filepath
+        if self.position:
+            s += '%d.%d:' % (self.position[0], self.position[1])
+        if s:
+            s += ' '
+        return s + self.message
     
-def xhtml5(body,metadata):
+def error(message, filepath=None, position=None, fatal=False, warning=False):
+    '''fatal: raises HaxError. Otherwise the error or warning is printed to stderr'''
     
-    doc = '<?xml version="1.0" encoding="utf-8"?>\n'
-    doc += '<!DOCTYPE html>\n'
-    doc += '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="%s">\n<head>\n' % metadata['dc:language']
-    doc += '<title>%s</title>\n' % metadata['dc:title']
-    #doc += '<meta charset="utf-8" />\n'
-    for m in metadata.keys():
-        doc += '<meta name="%s" content="%s" />\n' % (m, metadata[m])
-    doc += '''<style>
-    
-    </style>'''
-    doc += '</head>\n<body>\n'
-    doc += body
-    doc += '</body>\n</html>\n'
-    return doc
+    if fatal:
+        raise HaxError(message, filepath, position)
+    print(HaxError(message, filepath, position).report(warning), file=sys.stderr)
+
+class Converter():
+    '''
+    In-memory conversion of HaX text, for embedding hax.py in other programs:
     
-def xml(body):
-    doc = '<?xml version="1.0" encoding="utf-8"?>\n'
-    doc += body
-    return doc
+        converter = Converter('code/article.json', format='xhtml')
+        page = converter.convert(text)
+        
+    Without a string in between, converter.events(text, handler) sends SAX-like events
+    to a Handler, and converter.tree(text) builds an xml.etree.ElementTree element.
+    converter.encode(markup) goes the other way: html or xml to HaX.
+    converter.session(text) keeps a document that is edited (see Session).
+    converter.formats(text, ['html', 'xhtml']) converts one parse into several formats.
     
-def error(message, filepath=None, position=None, fatal=False, warning=False):
+    No filesystem I/O (except loading code or template when given as a path, and includes),
+    no output on stdout or stderr. Nothing is kept between calls: one Converter can convert any
+    number of documents, also from several threads. Errors are raised as HaxError, with filepath
+    and position.
+    
+    code: HaxCode, dict (loaded JSON) or path of JSON-file; or Dialects: every call selects its
+    dialect with dialect= (a name or hash, see Dialects), without loading or compiling
+    wrap: False returns only the converted body, without head and foot of format
+    profile: Profile, records the stages of all conversions (optional, not for several threads)
+    template: Template or path of template file, instead of the built-in template of format
+    include_root: directory of included fragments (<?hax include="file.hax"?>, relative to the
+    directory of filepath, or to include_root). Default None: nothing is included or read
+    '''
+    
+    def __init__(self, code, format='html', nocomment=False, void=False, wrap=True, profile=None, template=None, include_root=None):
+        
+        self.dialects = None
+        if isinstance(code, Dialects):
+            self.dialects = code
+            self.code = None
+        elif isinstance(code, HaxCode):
+            self.code = code
+        elif isinstance(code, dict):
+            self.code = HaxCode(code)
+        else:
+            self.code = HaxCode.load(code)
+        self.config = {'format': format, 'nocomment': nocomment, 'void': void, 'wait': False, 'verbose': False,
+                       'include_root': include_root and os.path.abspath(include_root)}
+        self.wrap = wrap
+        self.profile = profile
+        if template != None and not isinstance(template, Template):
+            template = Template.load(template)
+        self.custom = template # None: the built-in template of each format
+        self.template = template or TEMPLATES.get(format, TEMPLATES['xml'])
+        
+    def haxcode(self, dialect=None):
+        '''HaxCode of dialect: a name or hash (see Dialects), a HaxCode, or None: of the converter'''
+        
+        if isinstance(dialect, HaxCode):
+            return dialect
+        if dialect == None:
+            if self.code == None:
+                error("No dialect given", fatal=True)
+            return self.code
+        if self.dialects == None:
+            error("Dialect '%s' given, but the converter has no Dialects" % dialect, fatal=True)
+        return self.dialects.get(dialect)
+        
+    def parser(self, filepath=None, dialect=None):
+        '''a fresh Haxparser for one conversion'''
+        
+        config = dict(self.config)
+        config['basename'] = filepath
+        config['dirname'] = os.path.dirname(filepath) if filepath else None # of included fragments
+        return Haxparser(config, code=self.haxcode(dialect), profile=self.profile)
+        
+    def nodes(self, text, filepath=None, dialect=None):
+        '''list of nodes of text. filepath: name used in errors'''
+        
+        P = self.parser(filepath, dialect)
+        P.source = text
+        P.parse()
+        return P.nodes
+        
+    def events(self, text, handler, filepath=None, dialect=None):
+        '''sends the events of text to handler (see Handler), node by node: no list of nodes, no string'''
+        
+        P = self.parser(filepath, dialect)
+        P.source = text
+        dispatch(P.include(P.iterparse([text])), handler)
+        
+    def tree(self, text, root='body', filepath=None, dialect=None):
+        '''xml.etree.ElementTree element root with the nodes of text as children (see TreeBuilder)'''
+        
+        builder = TreeBuilder(root)
+        self.events(text, builder, filepath, dialect)
+        return builder.close()
+        
+    def encode(self, text, filepath=None, dialect=None):
+        '''HaX of html or xml text (see Encoder): convert() makes the same body of it again'''
+        
+        out = []
+        try:
+            encodeChunks([text], self.haxcode(dialect), out.append)
+        except HaxError as e:
+            e.filepath = filepath
+            raise
+        return ''.join(out)
+        
+    def convert(self, text, filepath=None, dialect=None):
+        '''converted document (string). filepath: name used in errors'''
+        
+        P = self.parser(filepath, dialect)
+        P.source = text
+        P.parse()
+        P.createXML()
+        if not self.wrap:
+            return P.xml
+        out = []
+        writeDocument(out.append, P.xml, self.config['format'], P.metadata, self.template)
+        return ''.join(out)
+        
+    def formats(self, text, formats, filepath=None, dialect=None):
+        '''{format: converted document} of text for every format of formats, from one parse'''
+        
+        P = self.parser(filepath, dialect)
+        P.source = text
+        P.parse()
+        documents = {}
+        for format in formats:
+            P.createXML(format)
+            if not self.wrap:
+                documents[format] = P.xml
+                continue
+            out = []
+            writeDocument(out.append, P.xml, format, P.metadata, self.custom)
+            documents[format] = ''.join(out)
+        return documents
+        
+    def session(self, text, filepath=None, dialect=None):
+        '''Session of text: edit() reparses only the changed blocks. filepath: name used in errors'''
+        
+        return Session(self, text, filepath, dialect)
+        
+class Session():
+    '''
+    incremental parsing of a document that is edited, for editors and live previews:
+    
+        session = Converter('code/article.json').session(text)
+        start, end, xml = session.edit(offset, deleted, inserted)
+        
+    The document is kept as blocks, which begin at a '<' at the start of a line outside any
+    tag or quote (see splitPoints), at least BLOCKSIZE characters apart. A block keeps its text,
+    its nodes (offsets from the start of the block), its xml, and a snapshot of the parse at
+    its start: modus, the open elements with their counters (tagstack) and the svg/math state
+    of the serializer. An edit changes the text of its blocks only, and is parsed again from
+    the block it begins in, block by block, up to a block after the edit that starts with the
+    same snapshot as before: from there on, nodes and xml are those of the previous text.
+    The xml (session.xml()) is the body that Converter.convert(text, wrap=False) makes of the
+    whole text.
+    Included fragments (see Haxparser.include) are read when their block is parsed: a changed
+    fragment shows at the next parse of the block.
+    '''
+    
+    BLOCKSIZE = 1024
+    
+    def __init__(self, converter, text, filepath=None, dialect=None):
+        
+        self.converter = converter
+        self.code = converter.haxcode(dialect) # kept for the whole session
+        self.filepath = filepath
+        self.dirty = None # [start, end] of text changed since the last successful parse
+        blocks, snapshot = self.parseRange(text, 0, ('hax', (), False), True)
+        self.starts = [a for a, B in blocks] # offsets of blocks in text
+        self.blocks = [B for a, B in blocks] # [snapshot, nodes, starts of nodes, xml, text]
+        
+    def parseBlock(self, region, a, b, snapshot, last):
+        '''
+        ([snapshot, nodes, starts of nodes, xml, text], snapshot at b) of region[a:b]
+        the snapshot at b is None when b is inside a tag or quote
+        '''
+        
+        modus, stack, foreign = snapshot
+        P = self.converter.parser(self.filepath, self.code)
+        P.source = text = region[a:b]
+        try:
+            nodes = list(P.include(P.iterparse([text], modus, partial=not last, stack=stack)))
+        except HaxError as e:
+            if e.position:
+                e.position = [e.position[0] + region.count('\n', 0, a)] + e.position[1:]
+            raise
+        parts = []
+        serializer = Serializer(parts.append, self.converter.config['format'], self.converter.config['nocomment'])
+        serializer.foreign = foreign
+        serializer.serialize(nodes)
+        end = None
+        if not last:
+            clean, modus, stack = P.endState
+            if clean:
+                end = (modus, tuple(tuple(T) for T in stack), serializer.foreign)
+        return [snapshot, nodes, [N.start for N in nodes], ''.join(parts), text], end
+        
+    def parseRange(self, region, a, snapshot, last):
+        '''
+        blocks of region[a:], parsed from snapshot: list of (offset in region, block), and the
+        snapshot at the end (None when the end is inside a tag or quote: then the last block
+        is not complete)
+        '''
+        
+        b = len(region)
+        points = [a + p for p in splitPoints(region[a:], self.code, self.BLOCKSIZE)[1:]] + [b]
+        blocks = []
+        for p in points:
+            block, end = self.parseBlock(region, a, p, snapshot, last and p == b)
+            if end == None and p != b: # inside a tag: the block goes on up to the next point
+                continue
+            blocks.append((a, block))
+            a = p
+            snapshot = end
+        return blocks, snapshot
+        
+    def edit(self, offset, deleted, inserted):
+        '''
+        replaces deleted characters at offset with inserted; returns (start, end, xml): xml
+        replaces the output from start to end of the previous xml.
+        Raises HaxError when the new text has an error: the text keeps the edit, the xml
+        stays as it was, and the next edit parses the range of both edits again.
+        '''
+        
+        starts = self.starts
+        blocks = self.blocks
+        size = starts[-1] + len(blocks[-1][4])
+        if offset < 0 or deleted < 0 or offset + deleted > size:
+            error('Edit (%d, %d) outside text of %d characters' % (offset, deleted, size), filepath=self.filepath, fatal=True)
+        end = offset + deleted
+        delta = len(inserted) - deleted
+        
+        # the text of the blocks from offset to end becomes one block, with their old xml
+        a = bisect.bisect_right(starts, offset) - 1
+        b = bisect.bisect_right(starts, end) - 1
+        A = blocks[a]
+        text = A[4][:offset-starts[a]] + inserted + blocks[b][4][end-starts[b]:]
+        blocks[a:b+1] = [[A[0], [], [], ''.join(B[3] for B in blocks[a:b+1]), text]] # nodes: after the next parse
+        del starts[a+1:b+1]
+        for k in range(a + 1, len(starts)):
+            starts[k] += delta
+            
+        def move(x):
+            '''offset x of the previous text in the new text'''
+            if x <= offset:
+                return x
+            return x + delta if x >= end else offset
+            
+        a, b = offset, offset + len(inserted)
+        if self.dirty != None:
+            a, b = min(a, move(self.dirty[0])), max(b, move(self.dirty[1]))
+        self.dirty = [a, b]
+        return self.reparse()
+        
+    def reparse(self):
+        '''parses the blocks of the dirty range again; returns (start, end, xml) of the changed output'''
+        
+        starts = self.starts
+        blocks = self.blocks
+        k = bisect.bisect_right(starts, self.dirty[0]) - 1
+        j = bisect.bisect_right(starts, self.dirty[1]) # first block that starts after the edit (and the character before it)
+        region = ''.join(B[4] for B in blocks[k:j])
+        pos = 0
+        snapshot = blocks[k][0]
+        new = []
+        try:
+            while True:
+                last = j == len(blocks)
+                parsed, snapshot = self.parseRange(region, pos, snapshot, last)
+                new.extend(parsed)
+                if last or snapshot == blocks[j][0]:
+                    break
+                if snapshot == None: # end is inside a tag: its block goes on in the next one
+                    pos, block = new.pop()
+                    snapshot = block[0]
+                else:
+                    pos = len(region)
+                region += blocks[j][4]
+                j += 1
+        except HaxError as e:
+            if e.position:
+                e.position = [e.position[0] + sum(B[4].count('\n') for B in blocks[:k])] + e.position[1:]
+            raise
+        start = sum(len(B[3]) for B in blocks[:k])
+        end = start + sum(len(B[3]) for B in blocks[k:j])
+        starts[k:j] = [starts[k] + p for p, B in new]
+        blocks[k:j] = [B for p, B in new]
+        self.dirty = None
+        return start, end, ''.join(B[3] for p, B in new)
+        
+    def text(self):
+        '''the text, with all edits'''
+        
+        return ''.join(B[4] for B in self.blocks)
+        
+    def xml(self):
+        '''the body in format, of the text after the last successful edit'''
+        
+        return ''.join(B[3] for B in self.blocks)
+        
+    def node(self, offset):
+        '''the node at offset of the text, with offsets of the text (a copy), or None'''
+        
+        k = bisect.bisect_right(self.starts, offset) - 1
+        while k >= 0:
+            nodes, nodeStarts = self.blocks[k][1:3]
+            i = bisect.bisect_right(nodeStarts, offset - self.starts[k]) - 1
+            if i >= 0:
+                N = nodes[i]
+                if offset < self.starts[k] + N.end:
+                    return Node(N.type, self.starts[k] + N.start, self.starts[k] + N.end, N.content, N.ns, N.name, N.attributes)
+                return None
+            k -= 1
+        return None
+        
+    def nodes(self):
+        '''generator: all nodes, with offsets of the text'''
+        
+        for a, B in zip(self.starts, self.blocks):
+            for N in B[1]:
+                yield Node(N.type, a + N.start, a + N.end, N.content, N.ns, N.name, N.attributes)
+                
+def convert(text, code, format='html', nocomment=False, void=False, wrap=True, template=None):
+    '''
+    converts HaX text to a string in format, without filesystem I/O. Raises HaxError.
+    For many conversions with the same code, make one Converter and reuse it.
+    '''
+    
+    return Converter(code, format=format, nocomment=nocomment, void=void, wrap=wrap, template=template).convert(text)
+    
+def encode(text, code):
+    '''
+    HaX of html or xml text, without filesystem I/O (see Encoder). Raises HaxError.
+    For many documents with the same code, make one Converter and reuse it.
+    '''
+    
+    return Converter(code).encode(text)
+    
+def fileHash(path):
+    '''sha1 (hex) of the bytes of file path'''
+    
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        chunk = f.read(1 << 20)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(1 << 20)
+    return h.hexdigest()
+    
+def commitOutput(part, output):
+    '''
+    replaces output by the freshly written file part, unless output has the same bytes:
+    then part is removed and output keeps its mtime (no churn for rsync, CDN or make).
+    returns (sha1 of output, True if output was (re)written)
+    '''
+    
+    digest = fileHash(part)
+    if os.path.isfile(output) and os.path.getsize(output) == os.path.getsize(part) and fileHash(output) == digest:
+        os.remove(part)
+        return digest, False
+    os.replace(part, output)
+    return digest, True
+    
+class Output():
+    '''
+    the output file and its compressed variants (compress: list like ['gz', 'xz'], see COMPRESSORS),
+    written in one pass: the text is encoded once per CHUNKSIZE characters and fed to the file and to
+    the compressors, no second read of the output. Compressed bytes do not depend on the time of the
+    build (gzip gets mtime 0), so an unchanged variant is not rewritten either.
+    Everything goes to '.part' files first: commit() replaces the outputs (see commitOutput),
+    abort() removes the parts.
+    Path '-' is stdout: every CHUNKSIZE characters are written as they come, without variants.
+    level: compression level for all variants (default: the default of the module)
+    '''
+    
+    def __init__(self, path, compress=None, level=None):
+        
+        self.path = path
+        self.parts = []
+        self.files = []
+        self.streams = []
+        self.buffer = []
+        self.size = 0
+        self.bytes = 0 # written to path
+        if path == '-':
+            if compress:
+                error("Compressed variants of stdout", fatal=True)
+            self.streams.append(sys.stdout.buffer)
+            self.writes = [self.streams[0].write]
+            return
+        try:
+            self.open(path, None, level)
+            for variant in compress or []:
+                self.open('%s.%s' % (path, variant), variant, level)
+        except BaseException:
+            self.abort()
+            raise
+        self.writes = [S.write for S in self.streams]
+        
+    def open(self, output, variant, level):
+        
+        part = output + '.part'
+        f = open(part, 'wb')
+        self.files.append(f)
+        self.parts.append((part, output))
+        if variant == None:
+            self.streams.append(f)
+        elif variant == 'gz':
+            self.streams.append(gzip.GzipFile(os.path.basename(output), 'wb', 9 if level == None else level, f, mtime=0))
+        elif variant == 'bz2':
+            import bz2 # optional module of Python
+            self.streams.append(bz2.BZ2File(f, 'wb', compresslevel=9 if level == None else max(level, 1)))
+        elif variant == 'xz':
+            import lzma # optional module of Python
+            self.streams.append(lzma.LZMAFile(f, 'wb', preset=level))
+        else:
+            error("Unknown compression '%s' (known: %s)" % (variant, ', '.join(COMPRESSORS)), fatal=True)
+            
+    def write(self, s):
+        
+        self.buffer.append(s)
+        self.size += len(s)
+        if self.size >= CHUNKSIZE:
+            self.flush()
+            
+    def flush(self):
+        
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        if os.linesep != '\n': # as a file opened in text mode
+            data = data.replace('\n', os.linesep)
+        data = data.encode('utf-8')
+        self.bytes += len(data)
+        for write in self.writes:
+            write(data)
+            
+    def close(self):
+        
+        for S in self.streams[1:]: # compressors write their last block to the file
+            S.close()
+        for f in self.files:
+            f.close()
+            
+    def commit(self):
+        '''closes all files and replaces the outputs. returns (sha1 of output, True if output was (re)written)'''
+        
+        try:
+            self.flush()
+            self.close()
+        except BaseException:
+            self.abort()
+            raise
+        if self.path == '-':
+            sys.stdout.buffer.flush()
+            return None, True
+        return [commitOutput(part, output) for part, output in self.parts][0]
+        
+    def abort(self):
+        
+        for S in self.streams[1:] + self.files:
+            try:
+                S.close()
+            except Exception:
+                pass
+        for part, output in self.parts:
+            if os.path.exists(part):
+                os.remove(part)
+                
+MANIFEST = '.hax-manifest.json'
+
+def buildSettings(config):
+    '''the options that change the bytes of the output'''
+    
+    settings = {'version': __VERSION__, 'format': config['format'], 'void': bool(config['void']), 'nocomment': bool(config['nocomment'])}
+    if len(config.get('formats') or []) > 1:
+        settings['formats'] = config['formats']
+    if config.get('template'):
+        settings['template'] = Template.load(config['template']).hash
+    if config.get('include_root'):
+        settings['include_root'] = config['include_root']
+    if config.get('compress'):
+        settings['compress'] = sorted(config['compress'])
+        settings['level'] = config.get('level')
+    return settings
+    
+def loadManifest(path):
+    '''manifest of incremental builds: {output: {source, sourceHash, codeHash, settings, outputHash, includes}}'''
+    
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get('version') == 1:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': 1, 'files': {}}
+    
+def saveManifest(path, manifest):
+    
+    part = path + '.part'
+    with open(part, 'w', encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(part, path)
+    
+def upToDate(entry, sourceHash, codeHash, settings, output):
+    '''True when entry of manifest shows that output was built from the same source, code and settings'''
+    
+    if entry == None:
+        return False
+    for format, path in formatOutputs(output, settings.get('formats') or [settings['format']]):
+        if not os.path.isfile(path):
+            return False
+        for variant in settings.get('compress', []):
+            if not os.path.isfile('%s.%s' % (path, variant)):
+                return False
+    if (entry['sourceHash'], entry['codeHash'], entry['settings']) != (sourceHash, codeHash, settings):
+        return False
+    for path, digest in entry.get('includes', {}).items(): # included fragments
+        try:
+            if fileHash(path) != digest:
+                return False
+        except OSError:
+            return False
+    stat = os.stat(output)
+    if [stat.st_size, stat.st_mtime_ns] == entry.get('outputStat'):
+        return True
+    return fileHash(output) == entry['outputHash'] # touched, but maybe not changed
+    
+def findSources(patterns):
+    '''
+    haxfiles of files, directories (searched recursively for *.hax) and globs
+    returns list of (path, root): output mirrors path relative to root
+    '''
+    
+    sources = []
+    seen = set()
+    for pattern in patterns:
+        pattern = os.path.abspath(pattern)
+        if os.path.isdir(pattern):
+            found = []
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                dirnames.sort()
+                found.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith('.hax'))
+            root = pattern
+        elif glob.has_magic(pattern):
+            found = sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+            root = pattern
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+        else:
+            found = [pattern]
+            root = os.path.dirname(pattern)
+        for p in found:
+            if p not in seen:
+                seen.add(p)
+                sources.append((p, root))
+    return sources
+    
+def formatOutputs(output, formats):
+    '''
+    [(format, output)] for every format of formats: the first format is written to output,
+    the others to output with the format as extension (page.html, page.xhtml, page.xml).
+    Two formats with the same output raise HaxError
+    '''
+    
+    if output == None:
+        return [(format, None) for format in formats]
+    base = os.path.splitext(output)[0]
+    outputs = [(formats[0], output)] + [(format, '%s.%s' % (base, format)) for format in formats[1:]]
+    for k, (format, path) in enumerate(outputs):
+        if path in [P for F, P in outputs[:k]]: # like page.html of xhtml,html
+            error('Output %s of format %s is also the output of format %s: the output needs the extension of the first format (%s)'
+                  % (path, format, formats[0], formats[0]), fatal=True)
+    return outputs
+    
+def outputPath(haxfile, root, config):
+    '''output of haxfile: next to haxfile, or mirrored into config['outdir']'''
+    
+    base = os.path.splitext(haxfile)[0]
+    if config.get('outdir'):
+        base = os.path.join(config['outdir'], os.path.relpath(base, root))
+    return '%s.%s' % (base, config['format'])
+    
+WORKER = {} # per process of a batch or a parallel parse: {'code': HaxCode}
+
+def initWorker(code):
+    '''loads HaXcode (path, or HaxCode) once per worker process'''
     
-    if warning:
-        s = '\n\tWARNING: '
+    if isinstance(code, HaxCode):
+        WORKER['code'] = code
     else:
-        s = '\n\tERROR: '
-    if filepath:
-        s += 'in %s ' % filepath
-    if position:
-        s += 'at %d.%d' % (position[0], position[1])
-    s += '\n\t%s' % message
-    print(s, file=sys.stderr)    
-    if fatal:
-        sys.exit()    
+        WORKER['code'] = HaxCode.load(code)
+        
+def splitPoints(source, code, size):
+    '''
+    offsets of probable top-level blocks of source, about size characters apart, beginning with 0:
+    a '<' of a named tag at the start of a line, not in a comment, CDATA or the content of a
+    skip or entities element. Only a guess: Haxparser.parseParallel() verifies every boundary.
+    '''
+    
+    names = code.skip | code.entities
+    names = names | set(short for short, EL in code.elementName.items() if EL[0] in names)
+    openers = ['<!--', re.escape('<![CDATA[')]
+    if names:
+        openers.append('<(?:%s)(?![\\w:-])' % '|'.join(re.escape(n) for n in sorted(names, key=len, reverse=True)))
+    opener = re.compile('|'.join(openers))
+    closers = {'<!--': '-->', '<![CDATA[': ']]>'} # other openers: '<//'
+    
+    points = [0]
+    p = 0 # source before p is outside comments, CDATA, skip and entities
+    i = size
+    while True:
+        j = source.find('\n<', i)
+        if j == -1:
+            break
+        j += 1
+        if source[j+1:j+2] in ['', ' ', '\t', '\n', '/', '!', '?', '>']: # not a named tag
+            i = j
+            continue
+        while p < j:
+            m = opener.search(source, p, j)
+            if m == None:
+                p = j
+                break
+            closer = closers.get(m.group(), '<//')
+            e = source.find(closer, m.end())
+            if e == -1: # rest of source is one block
+                return points
+            p = e + len(closer)
+        if p > j: # j is inside
+            i = p
+            continue
+        points.append(j)
+        i = j + size
+    return points
+    
+def parseBlock(source, base, modus, config, last, code=None, counted=False):
+    '''
+    nodes of source, a block of a document at offset base, starting in modus (see Haxparser.parseParallel)
+    code: HaxCode, default: code of worker process. last: source is the end of the document
+    counted: also counters of a Profile of the block (without nodes)
+    returns dict with base, end, modus, nodes (offsets in the document), (not last) endState
+    and (counted) counters, or with error: (message, position), line of position counted from the block
+    '''
+    
+    profile = Profile() if counted else None
+    P = Haxparser(config, code=code or WORKER['code'], profile=profile)
+    P.source = source
+    R = {'base': base, 'end': base + len(source), 'modus': modus}
+    if counted:
+        R['counters'] = profile.counters
+    try:
+        nodes = list(P.iterparse([source], modus, partial=not last))
+    except HaxError as e:
+        R['error'] = (e.message, e.position)
+        return R
+    if base:
+        for N in nodes:
+            N.start += base
+            N.end += base
+    R['nodes'] = nodes
+    if not last:
+        R['endState'] = P.endState
+    if counted:
+        del profile.counters['nodes']
+    return R
+    
+def readStdin():
+    '''
+    generator: stdin in chunks as they arrive (up to CHUNKSIZE bytes), not waiting for a full chunk:
+    a document is parsed while its writer still writes. utf-8, newlines as open() reads them
+    '''
+    
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), True)
+    read = sys.stdin.buffer.read1
+    while True:
+        data = read(CHUNKSIZE)
+        chunk = decoder.decode(data, final=not data)
+        if chunk:
+            yield chunk
+        if not data:
+            return
+            
+class Documents():
+    '''
+    documents in a stream of chunks, separated by null characters: iterating gives every
+    document as a generator of its chunks. A document is read up to its separator and no further,
+    so it is converted before the next one arrives. What a consumer leaves of a document is
+    skipped. A separator at the end does not start another document.
+    '''
+    
+    def __init__(self, chunks, separator='\0'):
+        
+        self.chunks = iter(chunks)
+        self.separator = separator
+        self.rest = '' # read, not yet given
+        self.eof = False
+        self.done = True # current document read up to its separator
+        
+    def more(self):
+        '''next chunk into self.rest; False at the end of the stream'''
+        
+        self.rest = next(self.chunks, '')
+        self.eof = self.rest == ''
+        return not self.eof
+        
+    def document(self):
+        
+        self.done = False
+        while True:
+            i = self.rest.find(self.separator)
+            if i != -1:
+                chunk, self.rest = self.rest[:i], self.rest[i+1:]
+                self.done = True
+                if chunk:
+                    yield chunk
+                return
+            if self.rest:
+                chunk, self.rest = self.rest, ''
+                yield chunk
+            if not self.more():
+                self.done = True
+                return
+                
+    def __iter__(self):
+        
+        while True:
+            if not self.done: # skip the rest of the last document
+                for chunk in self.document():
+                    pass
+            if self.rest == '' and (self.eof or not self.more()):
+                return
+            yield self.document()
+            
+def encodeFile(config):
+    '''
+    encodes the html or xml file config['haxfile'] into the HaX file config['output'], chunk by chunk:
+    memory does not grow with the size of the file. Written to a '.part' file first (see Output).
+    '-' as file: stdin, as output: stdout
+    '''
+    
+    p = config['haxfile']
+    if p != '-' and not os.path.isfile(p):
+        error("File does not exist", filepath=p, fatal=True)
+    code = HaxCode.load(config['code'])
+    out = Output(config['output'])
+    try:
+        if p == '-':
+            encodeChunks(readStdin(), code, out.write)
+        else:
+            with open(p, encoding="utf-8") as source:
+                encodeChunks(iter(lambda: source.read(CHUNKSIZE), ''), code, out.write)
+    except BaseException as e:
+        out.abort()
+        if isinstance(e, HaxError):
+            e.filepath = '<stdin>' if p == '-' else p
+        raise
+    return out.commit()
+    
+def pipe(config):
+    '''
+    null-separated documents from stdin to stdout (hax.py - --null), for one long-running process
+    that converts the documents of a generator: every document is converted as it arrives (see
+    Documents), written to stdout and followed by a null character and a flush.
+    An error is reported to stderr with the number of the document, as <stdin 3>; the output of
+    that document is empty or incomplete, its null character is written all the same.
+    returns the number of documents with errors
+    '''
+    
+    code = HaxCode.load(config['code'])
+    failed = 0
+    for n, document in enumerate(Documents(readStdin()), 1):
+        try:
+            Haxparser(dict(config, input=document, basename='<stdin %d>' % n), code=code)
+        except HaxError as e:
+            failed += 1
+            print(e.report(), file=sys.stderr)
+        sys.stdout.buffer.write(b'\0')
+        sys.stdout.buffer.flush()
+    return failed
+    
+def buildFile(config):
+    '''
+    converts one haxfile of a batch, with the HaxCode of the worker.
+    returns dict with haxfile, output, seconds, ok, (when not ok) the error message
+    and (with config['profile']) the report of its Profile
+    '''
+    
+    result = {'haxfile': config['haxfile'], 'output': config['output'], 'ok': True, 'error': None}
+    profile = Profile() if config.get('profile') else None
+    start = time.perf_counter()
+    err = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(err):
+            if config.get('outdir'):
+                os.makedirs(os.path.dirname(config['output']), exist_ok=True)
+            HD = Haxparser(config, code=WORKER['code'], profile=profile)
+        result['outputHash'] = HD.outputHash
+        result['written'] = HD.written
+        result['outputs'] = list(HD.hashes)
+        result['includes'] = list(HD.includes)
+    except HaxError as e:
+        result['ok'] = False
+        err.write(e.report())
+    except Exception as e:
+        result['ok'] = False
+        err.write('\n\t%s: %s' % (type(e).__name__, e))
+    result['seconds'] = time.perf_counter() - start
+    if err.getvalue():
+        result['error'] = err.getvalue().strip()
+    if profile != None:
+        result['profile'] = profile.report()
+    return result
+    
+def checkFile(config):
+    '''
+    checks one haxfile (see Haxparser.check) with the HaxCode of the worker: nothing is written.
+    returns dict with haxfile, ok, seconds and errors: list of {'line', 'col', 'message'}
+    '''
+    
+    result = {'haxfile': config['haxfile'], 'ok': True, 'errors': []}
+    start = time.perf_counter()
+    try:
+        result['errors'] = Haxparser(config, code=WORKER['code']).errors
+    except HaxError as e: # not parsed at all
+        result['errors'] = [{'line': e.line, 'col': e.col, 'message': e.message}]
+    except Exception as e:
+        result['errors'] = [{'line': None, 'col': None, 'message': '%s: %s' % (type(e).__name__, e)}]
+    result['ok'] = len(result['errors']) == 0
+    result['seconds'] = time.perf_counter() - start
+    return result
+    
+def checkBatch(config, sources):
+    '''
+    check mode: checks the haxfiles of sources (see findSources) across a pool of config['jobs']
+    processes (default: all CPU cores), each haxfile in one pass that collects all its errors.
+    returns the report: dict with files, failed, errors (all files), jobs, seconds and
+    results of checkFile() in order of sources
+    '''
+    
+    code = HaxCode.load(config['code']) # a broken HaXcode is reported once
+    configs = []
+    for haxfile, root in sources:
+        c = dict(config)
+        c['haxfile'] = haxfile
+        c['verbose'] = False # stdout is the report
+        configs.append(c)
+    jobs = config.get('jobs') or os.cpu_count() or 1
+    jobs = min(jobs, max(1, len(configs)))
+    start = time.perf_counter()
+    if jobs == 1:
+        initWorker(code)
+        results = [checkFile(c) for c in configs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initWorker, initargs=(code,)) as pool:
+            results = list(pool.map(checkFile, configs, chunksize=max(1, len(configs) // (4 * jobs))))
+    return {'files': len(results), 'failed': len([r for r in results if not r['ok']]), 'errors': sum(len(r['errors']) for r in results),
+            'jobs': jobs, 'seconds': time.perf_counter() - start, 'results': results}
+    
+def batchConfigs(config, sources):
+    '''config per haxfile of sources (see findSources)'''
+    
+    configs = []
+    for haxfile, root in sources:
+        c = dict(config)
+        c['haxfile'] = haxfile
+        c['parallel'] = False # the haxfiles are already built in parallel
+        if config.get('output') and len(sources) == 1:
+            c['output'] = config['output']
+        else:
+            c['output'] = outputPath(haxfile, root, config)
+        configs.append(c)
+    return configs
+    
+def buildBatch(config, sources):
+    '''
+    converts many haxfiles across a pool of config['jobs'] processes (default: all CPU cores)
+    each worker loads the HaXcode once; a failing haxfile does not stop the batch.
+    Results are reported in order of sources, or with config['unordered'] as they complete.
+    
+    With config['incremental'] a manifest (config['manifest'], default .hax-manifest.json in outdir
+    or current directory) records the hashes of source, HaXcode, settings and output of every build.
+    Haxfiles with an up-to-date output are skipped without parsing.
+    
+    With config['profile'] the profiles of all haxfiles are added up and written (see writeProfile).
+    
+    returns list of results of buildFile()
+    '''
+    
+    configs = batchConfigs(config, sources)
+    if config.get('incremental'):
+        manifestPath = config.get('manifest') or os.path.join(config.get('outdir') or os.getcwd(), MANIFEST)
+        manifest = loadManifest(manifestPath)
+        codeHash = HaxCode.load(config['code']).hash
+        settings = buildSettings(config)
+        todo = []
+        hashes = {}
+        for c in configs:
+            try:
+                hashes[c['output']] = fileHash(c['haxfile'])
+            except OSError: # reported by buildFile
+                todo.append(c)
+                continue
+            if not upToDate(manifest['files'].get(c['output']), hashes[c['output']], codeHash, settings, c['output']):
+                todo.append(c)
+        skipped = len(configs) - len(todo)
+        configs = todo
+        
+    jobs = config.get('jobs') or os.cpu_count() or 1
+    jobs = min(jobs, max(1, len(configs)))
+    start = time.perf_counter()
+    results = []
+    
+    def report(r):
+        results.append(r)
+        status = 'ok' if r['ok'] else 'FAILED'
+        print('%8.3fs  %-6s %s -> %s' % (r['seconds'], status, r['haxfile'], ', '.join(r.get('outputs') or [r['output']])))
+        if r['error']:
+            print('\t' + r['error'].replace('\n', '\n\t'))
+            
+    if jobs == 1:
+        initWorker(config['code'])
+        for c in configs:
+            report(buildFile(c))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initWorker, initargs=(config['code'],)) as pool:
+            futures = [pool.submit(buildFile, c) for c in configs]
+            if config.get('unordered'):
+                futures = concurrent.futures.as_completed(futures)
+            for f in futures:
+                report(f.result())
+                
+    if config.get('incremental'):
+        for r in results:
+            if r['ok'] and r['haxfile'] and r['output'] in hashes:
+                stat = os.stat(r['output'])
+                manifest['files'][r['output']] = {'source': r['haxfile'], 'sourceHash': hashes[r['output']], 'codeHash': codeHash,
+                                                  'settings': settings, 'outputHash': r['outputHash'], 'outputStat': [stat.st_size, stat.st_mtime_ns],
+                                                  'includes': {p: fileHash(p) for p in r['includes']}}
+            else:
+                manifest['files'].pop(r['output'], None)
+        saveManifest(manifestPath, manifest)
+        
+    failed = len([r for r in results if not r['ok']])
+    wall = time.perf_counter() - start
+    work = sum(r['seconds'] for r in results)
+    unchanged = len([r for r in results if r['ok'] and not r.get('written')])
+    print('\n%d files, %d failed, %d unchanged output, %d jobs: %.3fs wall, %.3fs work' % (len(results), failed, unchanged, jobs, wall, work))
+    if config.get('incremental'):
+        print('%d up to date (skipped)' % skipped)
+    if results:
+        slowest = max(results, key=lambda r: r['seconds'])
+        print('slowest: %.3fs %s' % (slowest['seconds'], slowest['haxfile']))
+    if config.get('profile'):
+        profile = Profile()
+        for r in results:
+            if 'profile' in r:
+                profile.merge(r['profile'])
+        writeProfile(profile, config['profile'])
+    return results
+    
+def writeProfile(profile, path):
+    '''writes the report of profile (JSON) to file path, or to stderr when path is '-' '''
+    
+    if path == '-':
+        print(profile.json(), file=sys.stderr)
+    else:
+        with open(path, 'w') as f:
+            f.write(profile.json() + '\n')
 
+def watch(config, patterns):
+    '''
+    resident mode: builds all haxfiles of patterns, then polls (os.stat, every config['interval'] seconds)
+    the haxfiles, the fragments they include, the HaXcode and the template and rebuilds the outputs of
+    changed haxfiles, and of the haxfiles that include a changed fragment.
+    The compiled HaXcode and template stay in memory; they are only reloaded when their file changes,
+    and then all haxfiles are rebuilt. A burst of saves is rebuilt once: only when nothing changed during
+    config['debounce'] seconds. Reports build time and latency (from detected change to written output).
+    Stops on KeyboardInterrupt (Ctrl-C).
+    '''
+    
+    interval = config.get('interval') or 0.5
+    debounce = config.get('debounce') or 0.2
+    
+    def stat(path):
+        try:
+            s = os.stat(path)
+            return (s.st_mtime_ns, s.st_size)
+        except OSError:
+            return None
+            
+    def build(c, detected):
+        r = buildFile(c)
+        includes[c['haxfile']] = r.get('includes') or []
+        for path in includes[c['haxfile']]:
+            if path not in fragments:
+                fragments[path] = stat(path)
+        latency = (time.perf_counter() - detected) * 1000
+        status = 'ok' if r['ok'] else 'FAILED'
+        print('%s  %-6s %s -> %s  (build %.1f ms, latency %.1f ms)' % (time.strftime('%H:%M:%S'), status, r['haxfile'], ', '.join(r.get('outputs') or [r['output']]), r['seconds'] * 1000, latency))
+        if r['error']:
+            print('\t' + r['error'].replace('\n', '\n\t'))
+            
+    WORKER['code'] = HaxCode.load(config['code'])
+    codeStat = stat(config['code'])
+    templateStat = config.get('template') and stat(config['template'])
+    configs = {c['haxfile']: c for c in batchConfigs(config, findSources(patterns))}
+    stats = {}
+    includes = {} # haxfile: paths of the fragments of its last build
+    fragments = {} # path of fragment: stat
+    for haxfile, c in configs.items():
+        stats[haxfile] = stat(haxfile)
+        build(c, time.perf_counter())
+    print('watching %d haxfiles and %s (Ctrl-C stops)' % (len(configs), config['code']))
+    
+    pending = {} # haxfile: time of first detection
+    last = None # time of last detected change
+    try:
+        while True:
+            time.sleep(interval)
+            now = time.perf_counter()
+            s = stat(config['code'])
+            if s != codeStat:
+                codeStat = s
+                try:
+                    WORKER['code'] = HaxCode.load(config['code'])
+                    for haxfile in configs:
+                        pending.setdefault(haxfile, now)
+                    last = now
+                except HaxError as e: # invalid JSON: keep previous code
+                    print(e.report(), file=sys.stderr)
+            if config.get('template'):
+                s = stat(config['template'])
+                if s != templateStat: # recompiled by Template.load() of the next build
+                    templateStat = s
+                    for haxfile in configs:
+                        pending.setdefault(haxfile, now)
+                    last = now
+            current = {c['haxfile']: c for c in batchConfigs(config, findSources(patterns))}
+            for haxfile in list(configs):
+                if haxfile not in current:
+                    print('%s  removed %s' % (time.strftime('%H:%M:%S'), haxfile))
+                    del configs[haxfile], stats[haxfile]
+                    includes.pop(haxfile, None)
+                    pending.pop(haxfile, None)
+            for haxfile, c in current.items():
+                s = stat(haxfile)
+                if s != stats.get(haxfile):
+                    configs[haxfile] = c
+                    stats[haxfile] = s
+                    pending.setdefault(haxfile, now)
+                    last = now
+            for path in list(fragments):
+                s = stat(path)
+                if s != fragments[path]:
+                    fragments[path] = s
+                    for haxfile in configs:
+                        if path in includes.get(haxfile, []):
+                            pending.setdefault(haxfile, now)
+                            last = now
+            if pending and now - last >= debounce:
+                for haxfile, detected in pending.items():
+                    if haxfile in configs:
+                        build(configs[haxfile], detected)
+                pending = {}
+    except KeyboardInterrupt:
+        print('\nstopped watching')
+        
+class RenderCache():
+    '''
+    LRU cache of rendered pages (bytes), bounded by the total size of the pages.
+    key: (haxfile, mtime, size, code hash, format, template hash, fragments): a changed haxfile,
+    HaXcode, template or included fragment ((path, mtime, size) of each) gives a new key, the
+    stale page is evicted when room is needed.
+    '''
+    
+    def __init__(self, size):
+    
+        self.size = size # bytes
+        self.used = 0
+        self.pages = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, key):
+    
+        page = self.pages.get(key)
+        if page == None:
+            self.misses += 1
+            return None
+        self.pages.move_to_end(key)
+        self.hits += 1
+        return page
+        
+    def put(self, key, page):
+    
+        if len(page) > self.size: # larger than the cache
+            return
+        if key in self.pages:
+            self.used -= len(self.pages.pop(key))
+        self.pages[key] = page
+        self.used += len(page)
+        while self.used > self.size:
+            self.used -= len(self.pages.popitem(last=False)[1])
+            
+class Server():
+    '''
+    preview server (hax.py serve DIR): serves the haxfiles of root as rendered pages over HTTP,
+    asyncio and the standard library only. /a/b.html renders a/b.hax as html, /a/b.xhtml as xhtml,
+    /a/b.xml as xml, /a/b.hax in config['format']. Other files (css, images) are served as they are;
+    a directory shows its index.hax, or a list of its haxfiles.
+    
+    Rendered pages are kept in a RenderCache. Reading and converting run in a thread pool: the event
+    loop never waits for a parse. Requests for the same page that is not yet in the cache share one
+    render. HaXcode and template are reloaded when their files change.
+    '''
+    
+    FORMATS = {'html': 'text/html; charset=utf-8', 'xhtml': 'application/xhtml+xml; charset=utf-8', 'xml': 'application/xml; charset=utf-8'}
+    STATUS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+    
+    def __init__(self, config, root):
+    
+        self.config = config
+        self.root = os.path.realpath(root)
+        if not os.path.isdir(self.root):
+            error("Not a directory", filepath=root, fatal=True)
+        self.cache = RenderCache(int((config.get('cache') or 64) * (1 << 20)))
+        self.rendering = {} # key: future of a render in progress
+        self.included = {} # (haxfile, format): paths of the fragments of its last render
+        self.executor = concurrent.futures.ThreadPoolExecutor(config.get('jobs') or None)
+        self.codeStat = None
+        self.loadCode()
+        
+    def loadCode(self):
+        '''self.code: the HaXcode, loaded again when its file changed'''
+        
+        try:
+            s = os.stat(self.config['code'])
+            s = (s.st_mtime_ns, s.st_size)
+        except OSError:
+            s = None
+        if s != self.codeStat or s == None:
+            self.code = HaxCode.load(self.config['code'])
+            self.codeStat = s
+        return self.code
+        
+    def render(self, haxfile, format, code, template):
+        '''(page of haxfile (bytes), (path, mtime, size) of its included fragments), in a thread of the pool'''
+        
+        with open(haxfile, encoding="utf-8") as f:
+            text = f.read()
+        converter = Converter(code, format=format, nocomment=self.config.get('nocomment', False), void=self.config.get('void', False), template=template,
+                              include_root=self.config.get('include_root'))
+        P = converter.parser(os.path.relpath(haxfile, self.root))
+        P.config['dirname'] = os.path.dirname(haxfile) # of included fragments
+        P.source = text
+        P.parse()
+        P.createXML()
+        out = []
+        writeDocument(out.append, P.xml, format, P.metadata, converter.template)
+        return ''.join(out).encode('utf-8'), tuple(sorted((path, k[0], k[1]) for path, k in P.includes.items()))
+        
+    def fragments(self, haxfile, format):
+        '''(path, mtime, size) of the fragments that haxfile included at its last render'''
+        
+        stats = []
+        for path in self.included.get((haxfile, format), []):
+            try:
+                s = os.stat(path)
+                stats.append((path, s.st_mtime_ns, s.st_size))
+            except OSError:
+                stats.append((path, None, None))
+        return tuple(stats)
+        
+    async def page(self, haxfile, format):
+        '''(page, 'hit', 'miss' or 'shared') of haxfile in format, from cache or rendered once for all requests'''
+        
+        s = os.stat(haxfile)
+        code = self.loadCode()
+        template = Template.load(self.config['template']) if self.config.get('template') else None
+        base = (haxfile, s.st_mtime_ns, s.st_size, code.hash, format, template and template.hash)
+        key = base + (self.fragments(haxfile, format),) # a changed fragment gives a new key
+        page = self.cache.get(key)
+        if page != None:
+            return page, 'hit'
+        future = self.rendering.get(key)
+        if future != None: # being rendered for another request
+            return (await asyncio.shield(future))[0], 'shared'
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.render, haxfile, format, code, template)
+        self.rendering[key] = future
+        def done(future):
+            del self.rendering[key]
+            if not future.cancelled() and future.exception() == None:
+                page, fragments = future.result()
+                self.included[(haxfile, format)] = [F[0] for F in fragments]
+                self.cache.put(base + (fragments,), page)
+        future.add_done_callback(done)
+        return (await asyncio.shield(future))[0], 'miss' # a closed connection does not cancel the render of others
+        
+    def resolve(self, url):
+        '''(kind, path, format) of url: kind is 'page', 'index', 'file' or None (not found)'''
+        
+        path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+        local = os.path.realpath(os.path.join(self.root, path.lstrip('/')))
+        if local != self.root and not local.startswith(self.root + os.sep): # outside root
+            return None, None, None
+        if os.path.isdir(local):
+            index = os.path.join(local, 'index.hax')
+            if os.path.isfile(index):
+                return 'page', index, self.config['format']
+            return 'index', local, None
+        base, ext = os.path.splitext(local)
+        if ext[1:] in self.FORMATS and os.path.isfile(base + '.hax'):
+            return 'page', base + '.hax', ext[1:]
+        if os.path.isfile(local):
+            if ext == '.hax':
+                return 'page', local, self.config['format']
+            return 'file', local, None
+        return None, None, None
+        
+    def index(self, directory, url):
+        '''list of the haxfiles and directories of directory (html)'''
+        
+        base = url.split('?')[0].rstrip('/')
+        items = []
+        for name in sorted(os.listdir(directory)):
+            if os.path.isdir(os.path.join(directory, name)):
+                items.append('<li><a href="%s/%s/">%s/</a></li>' % (base, urllib.parse.quote(name), html.escape(name)))
+            elif name.endswith('.hax'):
+                items.append('<li><a href="%s/%s.%s">%s</a></li>' % (base, urllib.parse.quote(name[:-4]), self.config['format'], html.escape(name)))
+        return ('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>%s</title></head>\n<body>\n<ul>\n%s\n</ul>\n</body>\n</html>\n' % (html.escape(base or '/'), '\n'.join(items))).encode('utf-8')
+        
+    def read(self, path):
+    
+        with open(path, 'rb') as f:
+            return f.read()
+            
+    async def respond(self, method, url):
+        '''(status, content type, body, cache) of request'''
+        
+        if method not in ['GET', 'HEAD']:
+            return 405, 'text/plain; charset=utf-8', b'Method Not Allowed\n', '-'
+        kind, path, format = self.resolve(url)
+        if kind == None:
+            return 404, 'text/plain; charset=utf-8', b'Not Found\n', '-'
+        if kind == 'index':
+            return 200, self.FORMATS['html'], self.index(path, url), '-'
+        if kind == 'file':
+            body = await asyncio.get_running_loop().run_in_executor(self.executor, self.read, path)
+            return 200, mimetypes.guess_type(path)[0] or 'application/octet-stream', body, '-'
+        try:
+            body, cache = await self.page(path, format)
+        except HaxError as e:
+            return 500, 'text/plain; charset=utf-8', e.report().encode('utf-8'), 'miss'
+        except (OSError, UnicodeError) as e:
+            return 500, 'text/plain; charset=utf-8', ('Could not read %s: %s\n' % (url, e)).encode('utf-8'), 'miss'
+        return 200, self.FORMATS[format], body, cache
+        
+    async def handle(self, reader, writer):
+        '''one request per connection'''
+        
+        start = time.perf_counter()
+        try:
+            line = (await reader.readline()).decode('latin-1').split()
+            if not line: # closed without request
+                writer.close()
+                return
+            while (await reader.readline()) not in [b'\r\n', b'\n', b'']: # headers are not used
+                pass
+        except (asyncio.LimitOverrunError, ValueError, ConnectionError):
+            writer.close()
+            return
+        if len(line) != 3:
+            method, url = '-', '-'
+            status, type, body, cache = 400, 'text/plain; charset=utf-8', b'Bad Request\n', '-'
+        else:
+            method, url = line[0], line[1]
+            status, type, body, cache = await self.respond(method, url)
+        head = ['HTTP/1.1 %d %s' % (status, self.STATUS[status]), 'Content-Type: %s' % type, 'Content-Length: %d' % len(body),
+                'Cache-Control: no-cache', 'X-Hax-Cache: %s' % cache, 'Connection: close', '', '']
+        try:
+            writer.write('\r\n'.join(head).encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        print('%s  %d %s %s %s (%.1f ms)' % (time.strftime('%H:%M:%S'), status, method, url, cache, (time.perf_counter() - start) * 1000), file=sys.stderr)
+        
+    async def run(self, host, port):
+    
+        server = await asyncio.start_server(self.handle, host, port)
+        print('serving %s at http://%s:%d/ (Ctrl-C stops)' % (self.root, host, port), file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+            
+def serve(config, root):
+    '''runs the preview server (see Server) on config['host'] and config['port'] until Ctrl-C'''
+    
+    server = Server(config, root)
+    try:
+        asyncio.run(server.run(config.get('host') or '127.0.0.1', config.get('port') or 8000))
+    except KeyboardInterrupt:
+        print('\nstopped serving (cache: %d hits, %d misses)' % (server.cache.hits, server.cache.misses), file=sys.stderr)
+    finally:
+        server.executor.shutdown()
+    
 def parseCommandLine():
     '''parsing arguments from command line
        converting args to dict
@@ -653,26 +3901,136 @@ def parseCommandLine():
     desc = "hax.py . version %s/%s . Licence: MIT \u00a9 notSue (http://purl.org/hax/info)" %  (__VERSION__, __DATE__)
     
     parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument("haxfile", help="path hax-sourceFile", nargs='?', default=None)
-    parser.add_argument("-o", "--output", help="output file (path). Optional (may be used to store backups)")
-    parser.add_argument("-f", "--format", help="Format of  output: 'xml', 'xhtml' or 'html'. Default: 'html'", default='html')
+    parser.add_argument("haxfile", help="path hax-sourceFile, '-' for stdin (output: stdout). More files, directories or globs: batch mode. 'serve DIR': preview server for the haxfiles of DIR", nargs='*', default=None)
+    parser.add_argument("-o", "--output", help="output file (path), '-' for stdout. Optional (may be used to store backups)")
+    parser.add_argument("-f", "--format", help="Format of  output: 'xml', 'xhtml' or 'html'. Default: 'html'. Comma separated for several outputs from one parse, like html,xhtml", default='html')
+    parser.add_argument("--include-root", help="allow <?hax include=\"file.hax\"?> of files in this directory (and below). Default: nothing is included")
     parser.add_argument("-c", "--code", help="JSON-file with hax codes. If missing, default html is used.", default='default')
     parser.add_argument("-n", "--nocomment", help="remove comments from XML/XHTML output", action='store_true')
     parser.add_argument("-v", "--verbose", help="Switch verbosity on", action='store_true')
     parser.add_argument("--void", help="Detect void elements of  html5", action='store_true')
     parser.add_argument('-w', "--wait", help="Do not create output-file. Parse, detect metadata and stop.", action='store_true')
+    parser.add_argument('-t', "--template", help="page template: a file with {{body}}, {{meta}} and metadata slots like {{dc:title}}. Default: built-in template of format")
+    parser.add_argument("--compress", help="also write compressed variants of the output: comma separated, of %s. Like: gz,xz" % ', '.join(COMPRESSORS))
+    parser.add_argument("--level", help="compression level (0-9) of --compress. Default: the default of each compressor", type=int, default=None)
+    parser.add_argument("--check", help="only check the haxfiles, in parallel: all errors with their positions as JSON to stdout, nothing is written", action='store_true')
+    parser.add_argument('-e', "--encode", help="the reverse: encode an html or xml file into HaX (output: .hax, not replaced without -o)", action='store_true')
+    parser.add_argument('-0', "--null", help="with haxfile '-': a stream of documents separated by null characters, converted one by one to stdout as they arrive, each followed by a null character", action='store_true')
+    parser.add_argument('-s', "--stream", help="Read, parse and write node by node: memory does not grow with the size of the haxfile", action='store_true')
+    parser.add_argument("-d", "--outdir", help="batch mode: output tree, mirroring the directories of the haxfiles")
+    parser.add_argument("-j", "--jobs", help="batch mode and --parallel: number of worker processes. Default: number of CPU cores", type=int, default=None)
+    parser.add_argument("--unordered", help="batch mode: report files as they are done, not in order", action='store_true')
+    parser.add_argument("-i", "--incremental", help="skip haxfiles whose output is up to date (see --manifest)", action='store_true')
+    parser.add_argument("--manifest", help="manifest of incremental builds. Default: %s in outdir or current directory" % MANIFEST)
+    parser.add_argument("--watch", help="keep running: rebuild outputs when haxfiles or HaXcode change", action='store_true')
+    parser.add_argument("--interval", help="watch mode: seconds between polls. Default: 0.5", type=float, default=0.5)
+    parser.add_argument("--debounce", help="watch mode: seconds without changes before rebuilding. Default: 0.2", type=float, default=0.2)
+    parser.add_argument("--parallel", help="parse a large haxfile by top-level blocks in -j/--jobs processes", action='store_true')
+    parser.add_argument("--host", help="serve mode: address. Default: 127.0.0.1", default='127.0.0.1')
+    parser.add_argument("--port", help="serve mode: port. Default: 8000", type=int, default=8000)
+    parser.add_argument("--cache", help="serve mode: size of the cache of rendered pages in MB. Default: 64", type=float, default=64)
+    parser.add_argument("--profile", help="write time, bytes and nodes per stage and counters as JSON to file PROFILE. Without PROFILE: to stderr", nargs='?', const='-', default=None)
     args = parser.parse_args()
     config = vars(args)
-    config['haxfile'] = os.path.abspath(os.path.join('.', config['haxfile']))
+    config['formats'] = []
+    for f in config['format'].split(','):
+        if f.strip() and f.strip() not in config['formats']:
+            config['formats'].append(f.strip())
+    if not config['formats']:
+        parser.error('-f/--format: no format')
+    config['format'] = config['formats'][0]
     if config['code'] != 'default':
         config['code'] = os.path.abspath(os.path.join('.', config['code']))
-    if config['output']:
-        config['output'] = os.path.abspath(os.path.join('.', config['output']))
+    if config['compress']:
+        config['compress'] = [v.strip() for v in config['compress'].split(',') if v.strip()]
+        for v in config['compress']:
+            if v not in COMPRESSORS:
+                parser.error("--compress: unknown variant '%s' (known: %s)" % (v, ', '.join(COMPRESSORS)))
+    if config['level'] != None and not 0 <= config['level'] <= 9:
+        parser.error('--level: 0 to 9')
+    if config['profile'] not in [None, '-']:
+        config['profile'] = os.path.abspath(os.path.join('.', config['profile']))
+    for p in ['outdir', 'manifest', 'output', 'template', 'include_root']:
+        if config[p] and config[p] != '-':
+            config[p] = os.path.abspath(os.path.join('.', config[p]))
+        
+    patterns = config['haxfile']
+    if len(patterns) == 0:
+        parser.error('no haxfile')
+    if '-' in patterns or config['output'] == '-':
+        if '-' in patterns and len(patterns) > 1 or config['outdir'] or config['incremental'] or config['watch']:
+            parser.error('- (stdin) is one haxfile, not for batch or watch mode')
+        if config['output'] in [None, '-'] and not config['check']:
+            if len(config['formats']) > 1:
+                parser.error('-f/--format: one format on stdout')
+            if config['compress']:
+                parser.error('--compress: no compressed variants of stdout')
+            if config['verbose']:
+                parser.error('-v/--verbose writes to stdout, the output')
+    if config['null'] and (patterns != ['-'] or config['output'] not in [None, '-'] or config['encode'] or config['check']):
+        parser.error('-0/--null converts documents from stdin to stdout')
+    if patterns[0] == 'serve' and not os.path.exists('serve'):
+        if len(patterns) > 2:
+            parser.error('serve takes one directory')
+        try:
+            serve(config, patterns[1] if len(patterns) == 2 else '.')
+        except HaxError as e:
+            print(e.report(), file=sys.stderr)
+            sys.exit(1)
+        return
+    if config['check']:
+        try:
+            report = checkBatch(config, [('-', None)] if patterns == ['-'] else findSources(patterns))
+        except HaxError as e:
+            print(e.report(), file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(report, indent=2))
+        if report['failed']:
+            sys.exit(1)
+        return
+    if len(patterns) > 1 or os.path.isdir(patterns[0]) or glob.has_magic(patterns[0]) or config['outdir'] or config['incremental'] or config['watch']:
+        sources = findSources(patterns)
+        if config['output'] and len(sources) != 1:
+            parser.error('-o/--output is for a single haxfile, use -d/--outdir in batch mode')
+        if config['encode']:
+            parser.error('-e/--encode is for a single file')
+    elif patterns[0] == '-':
+        sources = None
+        config['haxfile'] = '-'
+        config['output'] = config['output'] or '-'
+        config['stream'] = True # output as it is converted
     else:
-        ext = os.path.splitext(config['haxfile'])
-        config['output'] = '%s.%s' % (ext[0], config['format'])
+        sources = None
+        config['haxfile'] = os.path.abspath(os.path.join('.', patterns[0]))
+        if not config['output']:
+            ext = os.path.splitext(config['haxfile'])
+            config['output'] = '%s.%s' % (ext[0], 'hax' if config['encode'] else config['format'])
+            if config['encode'] and os.path.exists(config['output']): # a HaX source, not an output
+                parser.error('%s exists, give -o/--output to replace it' % config['output'])
         
-    HD = Haxparser(config)
+    try:
+        if config['encode']:
+            encodeFile(config)
+        elif config['null']:
+            if pipe(config):
+                sys.exit(1)
+        elif config['watch']:
+            watch(config, patterns)
+        elif sources != None:
+            results = buildBatch(config, sources)
+            if [r for r in results if not r['ok']]:
+                sys.exit(1)
+        elif config['profile']:
+            profile = Profile()
+            try:
+                HD = Haxparser(config, profile=profile)
+            finally:
+                writeProfile(profile, config['profile'])
+        else:
+            HD = Haxparser(config)
+    except HaxError as e:
+        print(e.report(), file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == '__main__':
     